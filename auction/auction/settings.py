@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 from datetime import timedelta
 
@@ -57,6 +58,9 @@ INSTALLED_APPS = [
 # ]
 
 
+# python manage.py test
+TESTING = sys.argv[1:2] == ['test']
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -81,6 +85,9 @@ LOGGING = {
         },
     },
 }
+if TESTING:
+    # scheduler.log is kept in the repository, test runs only log to the console
+    LOGGING['handlers']['file'] = {'class': 'logging.NullHandler'}
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # Must be at the top
@@ -122,6 +129,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock when a transaction starts, so concurrent bids and
+        # scheduler jobs wait for each other instead of failing with "database is locked"
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
@@ -183,6 +195,63 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 50,
 }
 
+# In-memory bid book with write-behind persistence (see bids/bidbook.py).
+# Keeps bid state in process memory, so only enable it for a single app process.
+BID_BOOK = {
+    'ENABLED': False,
+    'LOG_PATH': BASE_DIR / 'data' / 'bidbook.log',
+    'TOP_N': 10,
+    'FLUSH_INTERVAL': 1.0,
+    'BATCH_SIZE': 500,
+    'FSYNC': True,
+}
+
+# Background scheduler (see bids/scheduler.py). AUTOSTART starts it in app server
+# workers as well as under runserver; a file lock elects the one process that runs it.
+SCHEDULER = {
+    'AUTOSTART': False,
+    'LOCK_PATH': BASE_DIR / 'data' / 'scheduler.lock',
+    'LEADER_RETRY_INTERVAL': 15,
+    'RESYNC_INTERVAL': 60,
+    # Item saves in other processes send near deadlines to the leader through this socket
+    'INBOX_PATH': BASE_DIR / 'data' / 'scheduler.sock',
+    # Job metrics snapshot written by the leader, served at /api/scheduler-metrics/
+    'METRICS_PATH': BASE_DIR / 'data' / 'scheduler_metrics.json',
+    # Full retrains of the recommender; online updates keep vectors current in between
+    'TRAINING_INTERVAL': 6 * 60 * 60,
+    # Recommendation training runs in a child process with these limits
+    'TRAINING_NICENESS': 10,
+    'TRAINING_MEMORY_LIMIT_MB': None,
+    'TRAINING_TIMEOUT': 50 * 60,
+    # Processes that train in parallel; leave cores for the web workers
+    'TRAINING_WORKERS': 1,
+    # Recomputes the top-N recommendation lists of recently active users between trainings
+    'LISTS_REFRESH_INTERVAL': 10 * 60,
+}
+if TESTING:
+    # Items saved by tests are not sent to a scheduler running on this machine
+    SCHEDULER['INBOX_PATH'] = None
+
+# Latent vectors of the recommender (see bids/vectors.py). Every training run is
+# stored as a new version; processes check for a newer one every CHECK_INTERVAL seconds.
+RECOMMENDATIONS = {
+    'VECTORS_DIR': BASE_DIR / 'data' / 'latent_vectors',
+    'CHECK_INTERVAL': 5,
+    'KEEP_VERSIONS': 3,
+    # Length of the recommendation list precomputed per user by the training job
+    'TOP_N': 200,
+    # Catalogs with at least ANN_MIN_ITEMS active items get an IVF index; live scoring
+    # then only scores the ANN_NPROBE best of ANN_LISTS clusters (more probes, better recall)
+    'ANN_MIN_ITEMS': 100_000,
+    'ANN_LISTS': None,
+    'ANN_NPROBE': 16,
+    # New bids and visits nudge the user's vector right away (see bids/online.py);
+    # users who join between trainings get one of SPARE_USER_ROWS reserved rows
+    'ONLINE_UPDATES': True,
+    'ONLINE_UPDATE_INTERVAL': 1.0,
+    'SPARE_USER_ROWS': 10_000,
+}
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173", 
 ]
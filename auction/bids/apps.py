@@ -6,10 +6,22 @@ class BidsConfig(AppConfig):
 
     def ready(self):
         from .scheduler import scheduler
+        from .leader import leadership
+        from .training import WORKER_ENV
         import os
         import bids.signals
         
-        if os.environ.get('RUN_MAIN') != 'true':
+        # The recommendation training process never runs background jobs
+        if os.environ.get(WORKER_ENV):
+            return
+
+        # runserver's reloader child, or app server workers that opt in
+        if os.environ.get('RUN_MAIN') != 'true' and not scheduler.config['AUTOSTART']:
             return
             
-        scheduler.start()
\ No newline at end of file
+        # Every worker campaigns, only the one holding the lock runs the jobs
+        leadership.campaign(scheduler.start)
+
+        from .bidbook import bid_book
+        if bid_book.enabled:
+            bid_book.start()
\ No newline at end of file
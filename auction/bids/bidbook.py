@@ -0,0 +1,325 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from bids.models import Bid, Item, ProxyBid
+from bids.bidding import BidRejected, ItemNotFound, place_bid
+from bids.online import online_updater
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'LOG_PATH': os.path.join(settings.BASE_DIR, 'data', 'bidbook.log'),
+    'TOP_N': 10,
+    'FLUSH_INTERVAL': 1.0,
+    'BATCH_SIZE': 500,
+    'FSYNC': True,
+}
+
+
+class _Entry:
+    __slots__ = ('current_bid', 'number_of_bids', 'buy_price', 'ends', 'status', 'top', 'lock')
+
+    def __init__(self, current_bid, number_of_bids, buy_price, ends, status):
+        self.current_bid = current_bid
+        self.number_of_bids = number_of_bids
+        self.buy_price = buy_price
+        self.ends = ends
+        self.status = status
+        self.top = []
+        self.lock = threading.Lock()
+
+    def record(self, bidder_id, amount, top_n):
+        self.current_bid = amount
+        self.number_of_bids += 1
+        self.top.insert(0, (amount, bidder_id))
+        del self.top[top_n:]
+
+
+class BidBook:
+    """
+    Optional in-process bid book. Active items are kept in memory with their
+    current high bid, bid count and top-N bids, so a new bid is validated
+    without touching the database. Accepted bids are appended to a local log
+    and written behind to Bid/Item in batches by a flusher thread.
+
+    The book is authoritative for the process that owns it, so it is meant
+    for a single application process (or sticky routing per item). Items with
+    proxy bids are handed over to the database engine, which resolves them.
+    """
+
+    def __init__(self):
+        self.config = {**DEFAULTS, **getattr(settings, 'BID_BOOK', {})}
+        self.enabled = self.config['ENABLED']
+        self._entries = {}
+        self._pending = []
+        self._bought = set()
+        self._proxied = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._log = None
+        self.is_running = False
+
+    def start(self):
+        with self._lock:
+            if self.is_running:
+                return
+            self.is_running = True
+        self.rebuild()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+        logger.info(f"Bid book started with {len(self._entries)} active items")
+
+    def stop(self):
+        self.is_running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def rebuild(self):
+        """Loads active items and their top bids from the database, then replays the log."""
+        entries = {}
+        items = Item.objects.filter(status='active').values_list(
+            'id', 'current_bid', 'number_of_bids', 'buy_price', 'ends')
+        for item_id, current_bid, number_of_bids, buy_price, ends in items.iterator():
+            entries[item_id] = _Entry(current_bid, number_of_bids, buy_price, ends, 'active')
+
+        top_n = self.config['TOP_N']
+        bids = Bid.objects.filter(item__status='active').order_by('item_id', '-amount').values_list(
+            'item_id', 'bidder_id', 'amount')
+        for item_id, bidder_id, amount in bids.iterator():
+            entry = entries.get(item_id)
+            if entry is not None and len(entry.top) < top_n:
+                entry.top.append((amount, bidder_id))
+
+        proxied = set(ProxyBid.objects.filter(item__status='active').values_list('item_id', flat=True))
+
+        with self._lock:
+            self._entries = entries
+            self._proxied = proxied
+            self._pending = []
+            self._replay_log()
+
+    def _replay_log(self):
+        # Amounts strictly increase per item, so anything at or below the
+        # persisted current bid already reached the database
+        path = os.fspath(self.config['LOG_PATH'])
+        if not os.path.exists(path):
+            self._rewrite_log()
+            return
+        replayed = 0
+        with open(path) as log:
+            for line in log:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Torn write at crash time
+                amount = Decimal(record['amount'])
+                entry = self._entries.get(record['item'])
+                if entry is None or amount <= entry.current_bid:
+                    continue
+                entry.record(record['bidder'], amount, self.config['TOP_N'])
+                self._pending.append(record)
+                if record.get('bought'):
+                    entry.status = 'sold'
+                    self._bought.add(record['item'])
+                replayed += 1
+        self._rewrite_log()
+        if replayed:
+            logger.info(f"Bid book replayed {replayed} unflushed bids from {path}")
+
+    def _load(self, item_id):
+        try:
+            item = Item.objects.values_list(
+                'current_bid', 'number_of_bids', 'buy_price', 'ends', 'status').get(pk=item_id)
+        except (Item.DoesNotExist, ValueError):
+            raise ItemNotFound('Item does not exist.')
+        entry = _Entry(*item)
+        with self._lock:
+            return self._entries.setdefault(int(item_id), entry)
+
+    def place(self, item_id, bidder, amount):
+        """
+        Validates a bid against memory and logs it. Same contract as
+        bidding.place_bid, except that an accepted bid is returned unsaved,
+        without a primary key, until a flush writes it.
+        """
+        if not self.is_running:
+            self.start()
+        amount = Decimal(str(amount))
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            raise ItemNotFound('Item does not exist.')
+        if item_id in self._proxied:
+            return place_bid(item_id, bidder, amount)
+        entry = self._entries.get(item_id) or self._load(item_id)
+        now = timezone.now()
+
+        with entry.lock:
+            if item_id in self._proxied:
+                return place_bid(item_id, bidder, amount)
+            if entry.status != 'active':
+                raise BidRejected('Cannot place a bid on an item that is not active.')
+            if entry.ends <= now:
+                raise BidRejected('Auction has ended.')
+            if amount <= entry.current_bid:
+                raise BidRejected('Bid amount must be greater than the current bid.')
+            bought = entry.buy_price is not None and amount >= entry.buy_price
+            if bought:
+                amount = entry.buy_price
+                entry.status = 'sold'
+            entry.record(bidder.pk, amount, self.config['TOP_N'])
+            record = {'item': item_id, 'bidder': bidder.pk, 'amount': str(amount),
+                      'time': now.isoformat(), 'bought': bought}
+            self._append(record)
+
+        if bought:
+            self._wakeup.set()
+        return Bid(item_id=item_id, bidder=bidder, amount=amount, time=now)
+
+    def _append(self, record):
+        with self._lock:
+            self._pending.append(record)
+            if record['bought']:
+                self._bought.add(record['item'])
+            self._log.write(json.dumps(record) + '\n')
+            self._log.flush()
+            if self.config['FSYNC']:
+                os.fsync(self._log.fileno())
+
+    def _rewrite_log(self):
+        path = os.fspath(self.config['LOG_PATH'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as log:
+            for record in self._pending:
+                log.write(json.dumps(record) + '\n')
+        os.replace(path + '.tmp', path)
+        if self._log:
+            self._log.close()
+        self._log = open(path, 'a')
+
+    def top_bids(self, item_id):
+        entry = self._entries.get(int(item_id))
+        return list(entry.top) if entry else []
+
+    def flush(self):
+        """Writes pending bids to Bid/Item in batches and truncates the log."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                bought, self._bought = self._bought, set()
+            if not batch:
+                return 0
+
+            batch_size = self.config['BATCH_SIZE']
+            try:
+                with transaction.atomic():
+                    bids = Bid.objects.bulk_create([
+                        Bid(item_id=record['item'], bidder_id=record['bidder'],
+                            amount=Decimal(record['amount']))
+                        for record in batch
+                    ], batch_size=batch_size)
+                    # Bid.time is auto_now, so the insert stamped the flush time; the
+                    # accepted time is what orders equal bids in get_leading_bid
+                    for bid, record in zip(bids, batch):
+                        bid.time = datetime.fromisoformat(record['time'])
+                    Bid.objects.bulk_update(bids, ['time'], batch_size=batch_size)
+                    per_item = {}
+                    for bid in bids:
+                        count, _ = per_item.get(bid.item_id, (0, None))
+                        per_item[bid.item_id] = (count + 1, bid)
+                    for item_id, (count, leading_bid) in per_item.items():
+                        Item.objects.filter(pk=item_id).update(
+                            current_bid=leading_bid.amount, number_of_bids=F('number_of_bids') + count,
+                            leading_bid=leading_bid, leading_bidder_id=leading_bid.bidder_id)
+                    for item in Item.objects.filter(pk__in=bought, status='active'):
+                        item.close()
+            except Exception:
+                with self._lock:
+                    self._pending = batch + self._pending
+                    self._bought |= bought
+                raise
+
+            with self._lock:
+                self._rewrite_log()
+                for item_id in bought:
+                    self._entries.pop(item_id, None)
+            # bulk_create sends no post_save, so the online recommendation update is queued here
+            for bid in bids:
+                online_updater.record(bid.bidder_id, bid.item_id)
+            self._prune_proxied()
+            logger.info(f"Bid book flushed {len(batch)} bids on {len(per_item)} items")
+            return len(batch)
+
+    def _prune_proxied(self):
+        # Items handed over stay with the database engine until they close,
+        # which may happen in another process
+        with self._lock:
+            proxied = set(self._proxied)
+        if proxied:
+            closed = set(Item.objects.filter(pk__in=proxied).exclude(status='active').values_list('pk', flat=True))
+            with self._lock:
+                self._proxied -= closed
+
+    def refresh(self, item):
+        """Picks up edits to an item's end time, buy price or status. Bid state stays in memory."""
+        if item.status != 'active':
+            with self._lock:
+                self._proxied.discard(item.pk)
+        entry = self._entries.get(item.pk)
+        if entry is not None:
+            with entry.lock:
+                entry.ends = item.ends
+                entry.buy_price = item.buy_price
+                if entry.status == 'active':
+                    entry.status = item.status
+
+    def hand_over(self, item_id):
+        """Moves an item to the database engine before a proxy bid is registered on it."""
+        if not self.is_running:
+            self.start()
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            self._proxied.add(item_id)
+            entry = self._entries.get(item_id)
+        if entry is not None:
+            with entry.lock:
+                pass  # Wait for a bid already validated in memory to reach the log
+        self.flush()
+        with self._lock:
+            self._entries.pop(item_id, None)
+
+    def discard(self, item_ids):
+        """Drops closed items from memory once their bids are persisted."""
+        with self._lock:
+            for item_id in item_ids:
+                self._entries.pop(item_id, None)
+                self._proxied.discard(item_id)
+
+    def _flush_loop(self):
+        while self.is_running:
+            self._wakeup.wait(self.config['FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing bid book: {e}")
+            finally:
+                close_old_connections()
+
+
+bid_book = BidBook()
@@ -0,0 +1,171 @@
+import logging
+from decimal import Decimal, DefaultContext, localcontext
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from bids.models import Bid, Item, ProxyBid
+
+logger = logging.getLogger(__name__)
+
+PROXY_BID_INCREMENT = Decimal(str(getattr(settings, 'PROXY_BID_INCREMENT', '1.00')))
+
+
+class BidRejected(Exception):
+    """
+    Raised when a bid cannot be accepted, either because it lost the race
+    against a concurrent bid or because the item no longer takes bids.
+    """
+
+
+class ItemNotFound(BidRejected):
+    pass
+
+
+def place_bid(item_id, bidder, amount):
+    """
+    Accepts a bid with a single conditional UPDATE on the item row followed by
+    the Bid insert, both in one transaction. Concurrent bids on the same item
+    serialize on the row lock, so exactly one bid wins at each price level and
+    no increment of number_of_bids is lost. Proxy bids that the new bid
+    triggers are resolved in the same transaction.
+
+    Returns the created Bid, or raises BidRejected when the bid lost.
+    """
+    amount = Decimal(str(amount))
+    now = timezone.now()
+
+    with transaction.atomic():
+        try:
+            biddable = Item.objects.filter(
+                pk=item_id, status='active', ends__gt=now, current_bid__lt=amount
+            )
+        except (ValueError, TypeError):
+            raise ItemNotFound('Item does not exist.')
+        accepted = biddable.filter(
+            Q(buy_price__isnull=True) | Q(buy_price__gt=amount)
+        ).update(current_bid=amount, number_of_bids=F('number_of_bids') + 1)
+
+        bought = False
+        if not accepted:
+            # Bids at or above the buy price are capped to it and end the auction
+            bought = biddable.filter(
+                buy_price__lte=amount, current_bid__lt=F('buy_price')
+            ).update(current_bid=F('buy_price'), number_of_bids=F('number_of_bids') + 1)
+            if bought:
+                amount = Item.objects.values_list('buy_price', flat=True).get(pk=item_id)
+
+        if accepted or bought:
+            bid = Bid.objects.create(item_id=item_id, bidder=bidder, amount=amount)
+            _take_lead(item_id, bid)
+            if bought:
+                Item.objects.get(pk=item_id).close()
+            else:
+                resolve_proxy_bids(item_id, amount, bidder.pk)
+
+    if not (accepted or bought):
+        reason = _rejection_reason(item_id, amount, now)
+        logger.debug(f"Bid of {amount} by bidder {bidder.pk} on item {item_id} rejected: {reason}")
+        raise reason
+
+    logger.debug(f"Bid {bid.pk} of {amount} by bidder {bidder.pk} won item {item_id}"
+                 f"{' (bought)' if bought else ''}")
+    return bid
+
+
+def register_proxy_bid(item_id, bidder, max_amount):
+    """
+    Creates or raises the bidder's proxy on an item and immediately resolves
+    it against the current leader and every other proxy.
+    """
+    max_amount = Decimal(str(max_amount))
+    now = timezone.now()
+
+    with transaction.atomic():
+        try:
+            item = Item.objects.select_for_update().get(pk=item_id)
+        except (Item.DoesNotExist, ValueError):
+            raise ItemNotFound('Item does not exist.')
+        if item.status != 'active':
+            raise BidRejected('Cannot place a bid on an item that is not active.')
+        if item.ends <= now:
+            raise BidRejected('Auction has ended.')
+        if max_amount <= item.current_bid:
+            raise BidRejected('Maximum bid must be greater than the current bid.')
+
+        proxy, created = ProxyBid.objects.get_or_create(
+            item=item, bidder=bidder, defaults={'max_amount': max_amount, 'max_set_at': now})
+        if not created and proxy.max_amount != max_amount:
+            # Registering the same maximum again keeps its place among equal maximums
+            proxy.max_amount = max_amount
+            proxy.max_set_at = now
+            proxy.save(update_fields=['max_amount', 'max_set_at', 'updated_at'])
+        resolve_proxy_bids(item.pk, item.current_bid, item.leading_bidder_id)
+
+    return proxy
+
+
+def resolve_proxy_bids(item_id, price, leader_id):
+    """
+    Settles every proxy competing for an item in one pass, given the current
+    price and leading bidder. The highest maximum wins (the one set first on
+    ties) at one increment over the runner-up, capped at its own maximum, and
+    only that final Bid row is written. Must run inside the transaction that
+    accepted the triggering bid.
+
+    Returns the proxy's Bid, or None when no proxy outbids the leader.
+    """
+    contenders = list(
+        ProxyBid.objects.filter(item_id=item_id, max_amount__gt=price)
+        .order_by('-max_amount', 'max_set_at', 'pk')
+        .values_list('bidder_id', 'max_amount')
+    )
+    if not any(bidder_id != leader_id for bidder_id, _ in contenders):
+        return None
+    if not any(bidder_id == leader_id for bidder_id, _ in contenders):
+        # The leader without a (higher) proxy holds at the current price
+        contenders.append((leader_id, price))
+
+    (winner_id, winner_max), (_, runner_up_max) = contenders[0], contenders[1]
+    # bids.models sets a two digit precision on the main thread's context, which would round 151 to 150
+    with localcontext(DefaultContext):
+        new_price = min(winner_max, runner_up_max + PROXY_BID_INCREMENT)
+
+    buy_price = Item.objects.values_list('buy_price', flat=True).get(pk=item_id)
+    bought = buy_price is not None and new_price >= buy_price
+    if bought:
+        new_price = buy_price
+
+    # The triggering bid holds the row lock, so the compare-and-set only
+    # fails when a concurrent registration got in first
+    updated = Item.objects.filter(pk=item_id, current_bid=price, status='active').update(
+        current_bid=new_price, number_of_bids=F('number_of_bids') + 1)
+    if not updated:
+        raise BidRejected('The item received another bid, please try again.')
+    bid = Bid.objects.create(item_id=item_id, bidder_id=winner_id, amount=new_price)
+    _take_lead(item_id, bid)
+    if bought:
+        Item.objects.get(pk=item_id).close()
+
+    logger.debug(f"Proxy of bidder {winner_id} leads item {item_id} at {new_price} "
+                 f"over {len(contenders) - 1} contenders")
+    return bid
+
+
+def _take_lead(item_id, bid):
+    # The row is already locked by the accepting UPDATE, so this is a cheap primary key write
+    Item.objects.filter(pk=item_id).update(leading_bid=bid, leading_bidder_id=bid.bidder_id)
+
+
+def _rejection_reason(item_id, amount, now):
+    # Only losing bids pay for this read, the accepted path never loads the item
+    try:
+        item = Item.objects.get(pk=item_id)
+    except Item.DoesNotExist:
+        return ItemNotFound('Item does not exist.')
+    if item.status != 'active':
+        return BidRejected('Cannot place a bid on an item that is not active.')
+    if item.ends <= now:
+        item.check_and_update_status()
+        return BidRejected('Auction has ended.')
+    return BidRejected('Bid amount must be greater than the current bid.')
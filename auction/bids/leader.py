@@ -0,0 +1,68 @@
+import logging
+import os
+import threading
+import time
+from bids.scheduler_config import scheduler_config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class SchedulerLeadership:
+    """
+    Elects one process on the host to run the background scheduler. The
+    leader holds an exclusive lock on a local file for as long as it lives;
+    the kernel releases the lock when the process dies, and a standby process
+    that retries periodically takes over.
+    """
+
+    def __init__(self):
+        self.config = scheduler_config()
+        self.is_leader = False
+        self._lock_file = None
+
+    def try_acquire(self):
+        if fcntl is None:
+            logger.warning("File locks are not available, running the scheduler without leader election")
+            self.is_leader = True
+            return True
+
+        path = self.config['LOCK_PATH']
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock_file = open(path, 'a+')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f'{os.getpid()}\n')
+        lock_file.flush()
+        self._lock_file = lock_file
+        self.is_leader = True
+        return True
+
+    def campaign(self, on_elected):
+        """Calls on_elected once this process becomes the leader, retrying in the background."""
+        def run():
+            while not self.try_acquire():
+                time.sleep(self.config['LEADER_RETRY_INTERVAL'])
+            logger.info(f"Process {os.getpid()} is the scheduler leader")
+            on_elected()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def release(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_leader = False
+
+
+leadership = SchedulerLeadership()
@@ -0,0 +1,101 @@
+import logging
+import time
+from django.db import transaction
+from django.utils import timezone
+from bids.models import Bid, Item, WinningPair
+from bids.vectors import vector_store
+
+logger = logging.getLogger(__name__)
+
+CLOSE_BATCH_SIZE = 1000
+
+
+def close_ended_items(now=None, item_ids=None, batch_size=CLOSE_BATCH_SIZE):
+    """
+    Set-based equivalent of calling Item.close() on every active item that
+    has ended. Each batch is one transaction: items without bids are marked
+    expired, items with bids are marked sold and their WinningPair rows are
+    bulk created from the leading bid pointers.
+
+    The items are also taken out of the recommendation candidates.
+
+    Returns the ids of the items that were closed.
+    """
+    now = now or timezone.now()
+    ended = Item.objects.filter(status='active', ends__lte=now)
+    if item_ids is not None:
+        ended = ended.filter(id__in=item_ids)
+    ids = list(ended.values_list('id', flat=True))
+
+    closed = []
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        started = time.perf_counter()
+        with transaction.atomic():
+            # Re-checking the status keeps a concurrent close from closing an
+            # item twice, and the row locks keep bids out until the batch commits
+            batch_items = Item.objects.select_for_update().filter(id__in=batch, status='active')
+            expired_ids = list(batch_items.filter(number_of_bids=0).values_list('id', flat=True))
+            sold = list(batch_items.filter(number_of_bids__gt=0).values_list(
+                'id', 'leading_bid_id', 'leading_bidder_id'))
+            sold_ids = [item_id for item_id, _, _ in sold]
+
+            # The same conditions again, for databases without row locks
+            Item.objects.filter(id__in=expired_ids, status='active', number_of_bids=0).update(status='expired')
+            Item.objects.filter(id__in=sold_ids, status='active').update(status='sold')
+            WinningPair.objects.bulk_create(
+                [
+                    WinningPair(item_id=item_id, winning_bid_id=bid_id, winning_bidder_id=bidder_id)
+                    for item_id, bid_id, bidder_id in _with_leading_bids(sold)
+                ],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+        closed += expired_ids + sold_ids
+        vector_store.set_items_active(expired_ids + sold_ids, False)
+        logger.info(f"Closed batch of {len(expired_ids) + len(sold_ids)} items "
+                    f"({len(expired_ids)} expired, {len(sold_ids)} sold) "
+                    f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return closed
+
+
+def publish_due_items(now=None, item_ids=None):
+    """
+    Set-based equivalent of Item.publish() for scheduled auctions: every
+    pending item whose start time has passed becomes active in a single
+    UPDATE. The scheduled start time is kept as the item's start time.
+
+    Returns the ids of the published items, so callers can refresh caches
+    and indexes for them in bulk.
+    """
+    now = now or timezone.now()
+    due = Item.objects.filter(status='pending', started__lte=now)
+    if item_ids is not None:
+        due = due.filter(id__in=item_ids)
+
+    started = time.perf_counter()
+    with transaction.atomic():
+        published = list(due.select_for_update().values_list('id', flat=True))
+        if published:
+            # By id, so the rows updated are the rows returned even if the clock moved on
+            Item.objects.filter(id__in=published, status='pending').update(status='active')
+    if published:
+        vector_store.set_items_active(published, True)
+        logger.info(f"Published {len(published)} items in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return published
+
+
+def _with_leading_bids(sold):
+    # Items whose bids predate the leading bid pointer get their highest, earliest bid
+    missing = [item_id for item_id, bid_id, _ in sold if bid_id is None]
+    fallback = {}
+    if missing:
+        bids = Bid.objects.filter(item_id__in=missing).order_by('item_id', '-amount', 'time')
+        for item_id, bid_id, bidder_id in bids.values_list('item_id', 'id', 'bidder_id'):
+            fallback.setdefault(item_id, (item_id, bid_id, bidder_id))
+
+    for item_id, bid_id, bidder_id in sold:
+        if bid_id is not None:
+            yield item_id, bid_id, bidder_id
+        elif item_id in fallback:
+            yield fallback[item_id]
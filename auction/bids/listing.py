@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from django_countries import countries
+from authentication.models import UserProfile
+from bids.models import Category, Item
+
+DEFAULT_AVATAR = 'avatar-default-user-profile-icon-social-media-vector-57234208.jpg'
+
+
+class ItemListRows:
+    """
+    Renders item list pages exactly as ItemListSerializer does, without
+    building a model instance and a tree of serializer fields per row.
+
+    values() reads each item with its seller, the seller's user, profile and
+    bidder profile, and its location in one joined query; the page's
+    categories take one more. The rows are assembled into plain dicts, media
+    URLs are joined onto an absolute prefix built once per request and
+    country names are looked up once per code.
+
+    Keyset pagination keys on the ordering field and the id, both in the
+    values() rows, so values() querysets paginate like model querysets.
+    """
+    fields = [
+        'id', 'name', 'buy_price', 'current_bid', 'country', 'ends', 'status', 'main_image', 'first_bid',
+        'location_id', 'location__address', 'location__latitude', 'location__longitude',
+        'seller_id', 'seller__userID_id', 'seller__userID__username', 'seller__avg_rating',
+        'seller__rating_count', 'seller__userID__profile__id', 'seller__userID__profile__profile_image',
+        'seller__userID__profile__bio', 'seller__userID__bidder_id__id', 'seller__userID__bidder_id__country',
+    ]
+    default_image = f"{settings.MEDIA_URL}{Item._meta.get_field('main_image').get_default()}"
+    default_avatar = f"{settings.MEDIA_URL}{DEFAULT_AVATAR}"
+
+    def __init__(self, request=None):
+        self.request = request
+        self.item_images = self.media_urls(Item._meta.get_field('main_image').storage)
+        self.profile_images = self.media_urls(UserProfile._meta.get_field('profile_image').storage)
+        self.country_names = {}
+        if request is not None:
+            self.default_image_url = request.build_absolute_uri(self.default_image)
+            self.default_avatar_url = request.build_absolute_uri(self.default_avatar)
+        else:
+            self.default_image_url = self.default_avatar_url = None
+
+    @classmethod
+    def values(cls, queryset):
+        """The rows of an item queryset, in its filters and ordering, with the fields to_representation reads."""
+        # Annotations such as the search rank may be what the queryset is ordered by
+        return queryset.prefetch_related(None).values(*cls.fields, *queryset.query.annotations)
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        categories = {row['id']: [] for row in rows}
+        if categories:
+            # The query prefetch_related('categories') runs, for the same order
+            category_rows = Category.objects.filter(items__in=list(categories)).values_list('items', 'id', 'name')
+            for item_id, category_id, name in category_rows:
+                categories[item_id].append({'id': category_id, 'name': name})
+        return [self.item(row, categories[row['id']]) for row in rows]
+
+    def item(self, row, categories):
+        main_image = self.item_images(row['main_image']) if row['main_image'] else None
+        if self.request is not None:
+            main_image_url = main_image or self.default_image_url
+        else:
+            main_image_url = None
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'categories': categories,
+            'buy_price': _decimal_str(row['buy_price']),
+            'current_bid': _decimal_str(row['current_bid']),
+            'country': row['country'],
+            'location': {
+                'id': row['location_id'],
+                'address': row['location__address'],
+                'latitude': row['location__latitude'],
+                'longitude': row['location__longitude'],
+            },
+            'ends': _datetime_str(row['ends']),
+            'seller': self.seller(row),
+            'status': row['status'],
+            'main_image': main_image,
+            'first_bid': _decimal_str(row['first_bid']),
+            'main_image_url': main_image_url,
+        }
+
+    def seller(self, row):
+        image = row['seller__userID__profile__profile_image']
+        if row['seller__userID__profile__id'] is not None and image:
+            avatar_url = self.profile_images(image) if self.request is not None else None
+        else:
+            avatar_url = self.default_avatar_url
+        return {
+            'id': row['seller_id'],
+            'user_id': row['seller__userID_id'],
+            'username': row['seller__userID__username'],
+            'avg_rating': _decimal_str(row['seller__avg_rating']),
+            'rating_count': row['seller__rating_count'],
+            'profile': {
+                'profile_image_url': avatar_url,
+                'bio': row['seller__userID__profile__bio'] or '',
+            },
+            'country': self.country_name(row['seller__userID__bidder_id__country']),
+        }
+
+    def country_name(self, code):
+        if not code:
+            return None
+        if code not in self.country_names:
+            self.country_names[code] = str(countries.name(code))
+        return self.country_names[code]
+
+    def media_urls(self, storage):
+        """A function from a stored file name to its URL, absolute when there is a request."""
+        if isinstance(storage, FileSystemStorage):
+            prefix = storage.base_url
+            if self.request is not None:
+                prefix = self.request.build_absolute_uri(prefix)
+            return lambda name: prefix + filepath_to_uri(name).lstrip('/')
+        if self.request is not None:
+            return lambda name: self.request.build_absolute_uri(storage.url(name))
+        return storage.url
+
+
+def _decimal_str(value):
+    # DRF renders decimals as fixed-point strings
+    return None if value is None else f'{value:f}'
+
+
+def _datetime_str(value):
+    # As DRF's DateTimeField: in the current time zone, UTC written as Z
+    if value is None:
+        return None
+    if settings.USE_TZ and timezone.is_aware(value):
+        value = value.astimezone(timezone.get_current_timezone())
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
@@ -0,0 +1,61 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from bids import recommender
+from bids.vectors import vector_store
+
+
+class Command(BaseCommand):
+    help = ('Compares IVF approximate search with exact scoring of every item: recall@k and '
+            'p50/p99 latency per query for each nprobe setting.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1_000_000,
+                            help='Synthetic catalog size (ignored with --current)')
+        parser.add_argument('--current', action='store_true',
+                            help='Use the latent vectors of the current model instead of synthetic ones')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=50)
+        parser.add_argument('--lists', type=int, default=None, help='IVF lists, about sqrt(items) by default')
+        parser.add_argument('--nprobe', default='1,2,4,8,16,32,64')
+
+    def handle(self, *args, **options):
+        rng = np.random.RandomState(0)
+        if options['current']:
+            vectors = vector_store.current()
+            if vectors is None:
+                raise CommandError('No trained model found.')
+            item_matrix = np.asarray(vectors.items)
+            users = np.asarray(vectors.users)[rng.choice(len(vectors.users), options['queries'])]
+        else:
+            # Trained factors are non-negative and clipped, draw from the same range
+            item_matrix = rng.uniform(0.001, 1.5, size=(options['items'], recommender.LATENT_FACTORS))
+            users = rng.uniform(0.001, 1.5, size=(options['queries'], recommender.LATENT_FACTORS))
+        k = options['k']
+
+        started = time.perf_counter()
+        index = recommender.build_ivf(item_matrix, n_lists=options['lists'])
+        self.stdout.write(f"{len(item_matrix)} items, IVF index with {len(index.centroids)} lists "
+                          f"built in {time.perf_counter() - started:.2f} s")
+
+        exact, latencies = [], []
+        for user_vector in users:
+            started = time.perf_counter()
+            scores = item_matrix @ user_vector
+            top = np.argpartition(-scores, k - 1)[:k]
+            exact.append(set(top.tolist()))
+            latencies.append(time.perf_counter() - started)
+        self.report('exact', k, 1.0, latencies)
+
+        for nprobe in [int(value) for value in options['nprobe'].split(',')]:
+            recall, latencies = [], []
+            for user_vector, expected in zip(users, exact):
+                started = time.perf_counter()
+                rows = recommender.search_ivf(index, item_matrix, user_vector, k, nprobe)
+                latencies.append(time.perf_counter() - started)
+                recall.append(len(expected.intersection(rows.tolist())) / k)
+            self.report(f'nprobe={nprobe}', k, np.mean(recall), latencies)
+
+    def report(self, name, k, recall, latencies):
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        self.stdout.write(f"{name:>12}: recall@{k} {recall:.3f}  p50 {p50:7.2f} ms  p99 {p99:7.2f} ms")
@@ -0,0 +1,130 @@
+import itertools
+import random
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import connection, close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+from bids.models import Bid, Bidder, Item, Location, Seller
+from bids.bidding import place_bid, BidRejected
+
+User = get_user_model()
+
+BENCH_PREFIX = 'bench_bids_'
+
+
+def legacy_place_bid(item_id, bidder, amount):
+    """The read-modify-write path BidViewSet.create used before the bid engine."""
+    amount = Decimal(str(amount))
+    item = Item.objects.get(id=item_id)
+    if item.status != 'active' or item.ends < timezone.now():
+        raise BidRejected('Auction has ended.')
+    if amount <= item.current_bid:
+        raise BidRejected('Bid amount must be greater than the current bid.')
+    bid = Bid.objects.create(item=item, bidder=bidder, amount=amount)
+    item.current_bid = amount
+    item.number_of_bids += 1
+    item.save()
+    return bid
+
+
+class Command(BaseCommand):
+    help = ('Concurrent bid storm benchmark comparing the legacy read-modify-write path '
+            'with the atomic bid engine. Creates its own users and items and removes them afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--bids', type=int, default=2000, help='Bids per run')
+        parser.add_argument('--items', type=int, default=1, help='Items the storm is spread over')
+        parser.add_argument('--engine', choices=['legacy', 'atomic', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        engines = ['legacy', 'atomic'] if options['engine'] == 'both' else [options['engine']]
+        bidders = self.create_bidders(options['threads'])
+        try:
+            for engine in engines:
+                self.run(engine, bidders, options)
+        finally:
+            self.cleanup()
+
+    def create_bidders(self, count):
+        location = Location.objects.create(address=f'{BENCH_PREFIX}location')
+        bidders = []
+        for n in range(count):
+            user = User.objects.create(username=f'{BENCH_PREFIX}{n}')
+            bidders.append(Bidder.objects.create(userID=user, location=location, country='GR'))
+        Seller.objects.create(userID=bidders[0].userID)
+        return bidders
+
+    def create_items(self, count):
+        seller = Seller.objects.get(userID__username=f'{BENCH_PREFIX}0')
+        location = Location.objects.get(address=f'{BENCH_PREFIX}location')
+        return [
+            Item.objects.create(
+                name=f'{BENCH_PREFIX}item_{n}', current_bid=1, first_bid=1, country='GR',
+                location=location, seller=seller, description='', status='active',
+                started=timezone.now(), ends=timezone.now() + timedelta(hours=1),
+            ).id
+            for n in range(count)
+        ]
+
+    def cleanup(self):
+        Item.objects.filter(name__startswith=BENCH_PREFIX).delete()
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        Location.objects.filter(address__startswith=BENCH_PREFIX).delete()
+
+    def run(self, engine, bidders, options):
+        place = legacy_place_bid if engine == 'legacy' else place_bid
+        item_ids = self.create_items(options['items'])
+        counter = itertools.count()
+        counter_lock = threading.Lock()
+        accepted, rejected, errors = [0], [0], [0]
+        stats_lock = threading.Lock()
+
+        def storm(bidder):
+            rng = random.Random(bidder.pk)
+            while True:
+                with counter_lock:
+                    n = next(counter)
+                if n >= options['bids']:
+                    break
+                # Amounts rise with the storm but neighbouring bids race for the same level
+                amount = Decimal(2 + n // 4) + Decimal(rng.randint(0, 99)) / 100
+                try:
+                    place(rng.choice(item_ids), bidder, amount)
+                    outcome = accepted
+                except BidRejected:
+                    outcome = rejected
+                except Exception:
+                    outcome = errors
+                with stats_lock:
+                    outcome[0] += 1
+            connection.close()
+
+        threads = [threading.Thread(target=storm, args=(bidder,)) for bidder in bidders]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        close_old_connections()
+
+        lost = 0
+        for item in Item.objects.filter(id__in=item_ids):
+            bids = Bid.objects.filter(item=item)
+            highest = bids.aggregate(Max('amount'))['amount__max']
+            lost += abs(bids.count() - item.number_of_bids)
+            if highest is not None and highest != item.current_bid:
+                lost += 1
+
+        attempts = accepted[0] + rejected[0] + errors[0]
+        self.stdout.write(
+            f'{engine:>7}: {attempts / elapsed:8.1f} bids/s, {accepted[0] / elapsed:8.1f} accepted/s, '
+            f'accepted={accepted[0]} rejected={rejected[0]} errors={errors[0]} lost_updates={lost} '
+            f'({elapsed:.2f}s, {options["threads"]} threads)'
+        )
@@ -0,0 +1,170 @@
+import random
+import time
+from datetime import timedelta
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from bids.models import Bid, Bidder, Item, Location, Message, Seller, Visited, WinningPair
+
+User = get_user_model()
+
+BENCH_PREFIX = 'bench_indexes_'
+
+# (model, index name) of the indexes declared in bids.models Meta.indexes
+INDEXES = [
+    (Item, 'item_status_ends_idx'),
+    (Item, 'item_pending_started_idx'),
+    (Bid, 'bid_item_amount_idx'),
+    (Visited, 'visited_bidder_item_idx'),
+    (Message, 'message_pair_sent_idx'),
+    (Message, 'message_unread_idx'),
+]
+
+
+class Command(BaseCommand):
+    help = ('Generates a dataset and runs the hot item, bid, visit and message queries without and with '
+            'the indexes in Meta.indexes: query plan and median latency of each. Everything, the indexes '
+            'included, is rolled back afterwards, so the database is left as it was.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100_000)
+        parser.add_argument('--bids', type=int, default=1_000_000)
+        parser.add_argument('--visits', type=int, default=500_000)
+        parser.add_argument('--messages', type=int, default=200_000)
+        parser.add_argument('--users', type=int, default=2_000)
+        parser.add_argument('--repeat', type=int, default=50, help='Runs of each query, with different arguments')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.generate(options)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            self.stdout.write(f"Generated {options['items']} items, {options['bids']} bids, "
+                              f"{options['visits']} visits and {options['messages']} messages "
+                              f"in {time.perf_counter() - started:.1f} s")
+
+            queries = self.queries()
+            results = {}
+            for indexed in (False, True):
+                self.set_indexes(indexed)
+                for name, query in queries:
+                    plan = query(random.Random(0)).explain()
+                    rng = random.Random(1)
+                    times = []
+                    for _ in range(options['repeat']):
+                        queryset = query(rng)
+                        started = time.perf_counter()
+                        list(queryset)
+                        times.append(time.perf_counter() - started)
+                    results[name, indexed] = plan, np.median(times) * 1000
+
+            for name, _ in queries:
+                (plan_before, before), (plan_after, after) = results[name, False], results[name, True]
+                self.stdout.write(f"\n{name}: {before:.3f} ms -> {after:.3f} ms ({before / after:.1f}x)")
+                self.stdout.write(f"  without: {plan_before}".replace('\n', '\n           '))
+                self.stdout.write(f"  with:    {plan_after}".replace('\n', '\n           '))
+            transaction.set_rollback(True)
+
+    def set_indexes(self, indexed):
+        """Creates or drops the declared indexes, whether or not the migration that adds them has run."""
+        editor = connection.schema_editor(collect_sql=True)
+        with connection.cursor() as cursor:
+            for model, name in INDEXES:
+                index = next(index for index in model._meta.indexes if index.name == name)
+                existing = connection.introspection.get_constraints(cursor, model._meta.db_table)
+                if indexed and name not in existing:
+                    cursor.execute(str(index.create_sql(model, editor)))
+                elif not indexed and name in existing:
+                    cursor.execute(str(index.remove_sql(model, editor)))
+            if connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+
+    def generate(self, options):
+        rng = np.random.RandomState(0)
+        now = timezone.now()
+        location = Location.objects.create(address=f'{BENCH_PREFIX}location')
+        users = User.objects.bulk_create(
+            User(username=f'{BENCH_PREFIX}{n}') for n in range(options['users']))
+        bidders = Bidder.objects.bulk_create(
+            Bidder(userID=user, location=location, country='GR') for user in users)
+        sellers = Seller.objects.bulk_create(Seller(userID=user) for user in users[:options['users'] // 10])
+
+        # Most of a catalog is closed; some items are open, a few wait to be published
+        n_items = options['items']
+        statuses = rng.choice(['sold', 'expired', 'active', 'pending'], n_items, p=[0.5, 0.25, 0.22, 0.03])
+        ends = rng.uniform(-90, 30, n_items)
+        items = Item.objects.bulk_create((
+            Item(name=f'{BENCH_PREFIX}item_{n}', current_bid=1, first_bid=1, country='GR', location=location,
+                 seller=sellers[n % len(sellers)], description='', status=str(statuses[n]),
+                 started=now + timedelta(days=float(ends[n]) - 7), ends=now + timedelta(days=float(ends[n])))
+            for n in range(n_items)
+        ), batch_size=5000)
+
+        n_bids = options['bids']
+        bid_items = rng.randint(0, n_items, n_bids)
+        bid_bidders = rng.randint(0, len(bidders), n_bids)
+        amounts = rng.randint(100, 100_000, n_bids) / 100
+        Bid.objects.bulk_create((
+            Bid(item_id=items[bid_items[n]].pk, bidder_id=bidders[bid_bidders[n]].pk, amount=float(amounts[n]))
+            for n in range(n_bids)
+        ), batch_size=5000)
+
+        n_visits = options['visits']
+        visit_items = rng.randint(0, n_items, n_visits)
+        visit_bidders = rng.randint(0, len(bidders), n_visits)
+        Visited.objects.bulk_create((
+            Visited(item_id=items[visit_items[n]].pk, bidder_id=bidders[visit_bidders[n]].pk)
+            for n in range(n_visits)
+        ), batch_size=5000)
+        # visited_at is set on insert; move the visits out of the ten minute window, as most are
+        Visited.objects.filter(bidder__userID__username__startswith=BENCH_PREFIX).update(
+            visited_at=now - timedelta(days=30))
+
+        sold = [item for item, status in zip(items, statuses) if status == 'sold'][:max(options['messages'] // 20, 1)]
+        first_bids = dict(Bid.objects.filter(item__in=sold).order_by('-pk').values_list('item_id', 'pk'))
+        pairs = WinningPair.objects.bulk_create(
+            WinningPair(item=item, winning_bidder=bidders[n % len(bidders)], winning_bid_id=first_bids[item.pk])
+            for n, item in enumerate(sold) if item.pk in first_bids)
+        Message.objects.bulk_create((
+            Message(winning_pair=pairs[n % len(pairs)], sender=users[n % len(users)],
+                    recipient=users[(n * 7 + 1) % len(users)], content='', is_read=rng.rand() < 0.9)
+            for n in range(options['messages'])
+        ), batch_size=5000)
+
+        self.items = [item.pk for item in items]
+        self.bid_items = list({items[n].pk for n in bid_items[:10_000]})
+        self.bidders = [bidder.pk for bidder in bidders]
+        self.users = [user.pk for user in users]
+        self.pairs = [pair.pk for pair in pairs]
+
+    def queries(self):
+        """The queries the indexes are for, as the code paths run them, each taking a random.Random."""
+        now = timezone.now()
+        return [
+            ('close ended items (lifecycle, scheduler)',
+             lambda rng: Item.objects.filter(status='active', ends__lte=now).values_list('id', flat=True)),
+            ('ending_soon',
+             lambda rng: Item.objects.filter(status='active', ends__gte=now, ends__lte=now + timedelta(days=1))
+             .values_list('id', flat=True)),
+            ('item list page ordered by end time',
+             lambda rng: Item.objects.filter(status='active').order_by('ends').values_list('id', flat=True)[:50]),
+            ('publish due items',
+             lambda rng: Item.objects.filter(status='pending', started__lte=now).values_list('id', flat=True)),
+            ('leading bid (Item.get_leading_bid)',
+             lambda rng: Bid.objects.filter(item_id=rng.choice(self.bid_items))
+             .order_by('-amount', 'time').values_list('id', flat=True)[:1]),
+            # exists() drops the ordering
+            ('recent visit (record_visit)',
+             lambda rng: Visited.objects.filter(
+                 bidder_id=rng.choice(self.bidders), item_id=rng.choice(self.items),
+                 visited_at__gte=now - timedelta(minutes=10)).order_by().values_list('id', flat=True)[:1]),
+            ('conversation (winning pair messages)',
+             lambda rng: Message.objects.filter(winning_pair_id=rng.choice(self.pairs))
+             .order_by('sent_at').values_list('id', flat=True)),
+            ('unread messages (?recipient=&read=false)',
+             lambda rng: Message.objects.filter(recipient_id=rng.choice(self.users), is_read=False)
+             .order_by('-sent_at').values_list('id', flat=True)),
+        ]
@@ -0,0 +1,55 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from bids.listing import ItemListRows
+from bids.models import Item
+from bids.serializers import ItemListSerializer
+
+
+class Command(BaseCommand):
+    help = ('Renders the same pages of active items, ordered by end time, with ItemListSerializer and with '
+            'ItemListRows: median time per page (queries and rendering to JSON), queries per page and '
+            'whether the two outputs are identical.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='50,500', help='Page sizes')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--host', default='localhost', help='Host the media URLs are built with')
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/api/items/', HTTP_HOST=options['host']))
+        queryset = Item.objects.filter(status='active').order_by('ends', 'pk')
+
+        def serializer(size):
+            page = list(ItemListSerializer.eager_loading(queryset)[:size])
+            return JSONRenderer().render(ItemListSerializer(page, many=True, context={'request': request}).data)
+
+        def rows(size):
+            page = list(ItemListRows.values(queryset)[:size])
+            return JSONRenderer().render(ItemListRows(request).to_representation(page))
+
+        for size in [int(value) for value in options['sizes'].split(',')]:
+            if queryset[size - 1:size].count() == 0:
+                raise CommandError(f'Fewer than {size} active items.')
+            timings = {}
+            for name, render in [('ItemListSerializer', serializer), ('ItemListRows', rows)]:
+                with CaptureQueriesContext(connection) as queries:
+                    output = render(size)
+                times = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    render(size)
+                    times.append(time.perf_counter() - started)
+                timings[name] = output, np.median(times) * 1000, len(queries)
+
+            baseline = timings['ItemListSerializer'][1]
+            for name, (output, median, queries) in timings.items():
+                self.stdout.write(f"{size:>4} items  {name:<18} {median:8.2f} ms/page  {queries} queries  "
+                                  f"{baseline / median:5.1f}x")
+            same = timings['ItemListSerializer'][0] == timings['ItemListRows'][0]
+            self.stdout.write(f"{size:>4} items  identical output: {same}")
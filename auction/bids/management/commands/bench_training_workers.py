@@ -0,0 +1,45 @@
+import os
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from bids import recommender
+from bids.management.commands.bench_recommender import synthetic_interactions
+
+
+class Command(BaseCommand):
+    help = ('Trains on the same synthetic interactions with 1, 2, 4 and 8 worker processes: '
+            'time per epoch, speedup over one worker and held-out RMSE after the same number of epochs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interactions', type=int, default=1_700_000,
+                            help='Drawn pairs, before repeated pairs are dropped')
+        parser.add_argument('--users', type=int, default=50_000)
+        parser.add_argument('--items', type=int, default=100_000)
+        parser.add_argument('--epochs', type=int, default=5)
+        parser.add_argument('--workers', default='1,2,4,8')
+
+    def handle(self, *args, **options):
+        interactions = synthetic_interactions(options['users'], options['items'], options['interactions'])
+        order = np.random.RandomState(1).permutation(len(interactions.values))
+        test_size = len(order) // 5
+        test, fit = order[:test_size], order[test_size:]
+        fit_interactions = recommender.Interactions(
+            interactions.users[fit], interactions.items[fit], interactions.values[fit], interactions.shape)
+        self.stdout.write(f"{len(fit)} training and {len(test)} held-out user/item pairs, "
+                          f"{os.cpu_count()} CPUs")
+
+        baseline = None
+        for workers in [int(value) for value in options['workers'].split(',')]:
+            epoch_ends = []
+            started = time.perf_counter()
+            user_matrix, item_matrix = recommender.train(
+                fit_interactions, epochs=options['epochs'], workers=workers,
+                on_epoch=lambda *args: epoch_ends.append(time.perf_counter()))
+            total = time.perf_counter() - started
+            # Starting the pool counts towards the total only
+            per_epoch = np.mean(np.diff(epoch_ends)) if len(epoch_ends) > 1 else total
+            baseline = baseline or per_epoch
+            rmse = recommender.rmse(user_matrix, item_matrix, interactions.users[test],
+                                    interactions.items[test], interactions.values[test])
+            self.stdout.write(f"{workers:>3} workers: {per_epoch:7.2f} s/epoch, {total:7.2f} s total, "
+                              f"speedup {baseline / per_epoch:4.1f}x, held-out RMSE {rmse:.4f}")
@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from bids.search import item_search
+
+
+class Command(BaseCommand):
+    help = ('Builds the item full-text index, or the parts of it that are missing. migrate does this too; '
+            'searches use LIKE until the index exists.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        started = time.time()
+        if not item_search.build(options['database']):
+            raise CommandError('This database has no full-text search support, searches keep using LIKE.')
+        self.stdout.write(self.style.SUCCESS(f'Built the item search index in {time.time() - started:.2f} seconds'))
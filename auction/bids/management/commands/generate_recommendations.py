@@ -1,17 +1,25 @@
 import os
+import time
+from datetime import datetime, timezone as dt_timezone
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
+from django.db.models import Case, When, Value
+from django.db.models.functions import Coalesce
 from collections import defaultdict
+from itertools import islice
 from authentication.models import UserProfile
 from bids.models import (
     Bid, Visited, Bidder, Item
     )
 import numpy as np
-from bids.utils import generate_recommendations
-from sklearn.model_selection import train_test_split 
-
-ROOT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+from bids import recommender
+from bids.vectors import Candidates, vector_store
 
+EXTRACT_CHUNK_SIZE = 10_000
 
 np.set_printoptions(threshold=np.inf)  # Don't truncate any output
 
@@ -25,217 +33,229 @@ def map_to_str(num):
 class Command(BaseCommand):
     help = 'Generate recommendations for users based on their activity using matrix factorization.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--niceness', type=int, default=0,
+                            help='Lower the scheduling priority of this process by this much.')
+        parser.add_argument('--memory-limit', type=int, default=None,
+                            help='Cap the address space of this process, in megabytes.')
+        parser.add_argument('--chunk-size', type=int, default=EXTRACT_CHUNK_SIZE,
+                            help='Rows fetched and written per round trip while extracting data.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Train in this many processes sharing the factor matrices.')
+        parser.add_argument('--refresh-lists', action='store_true',
+                            help='Skip training and only recompute the top-N lists of users '
+                                 'with new bids or visits since the lists were last written.')
+
     def handle(self, *args, **options):
-        matrix, user_indexes, item_indexes = self.extract_data()
+        self.apply_limits(options['niceness'], options['memory_limit'])
+        # Activity from here on is picked up by the next refresh
+        started = time.time()
+        if options['refresh_lists']:
+            self.refresh_lists(started)
+            return
+        interactions, user_indexes, item_indexes = self.extract_data(options['chunk_size'])
         print(f"Len of usr_indx: ${len(user_indexes)}\nLen of item_indx: ${len(item_indexes)}")
-        user_vectors, item_vectors = self.train_model(matrix, user_indexes, item_indexes)
+        user_vectors, item_vectors = self.train_model(interactions, user_indexes, item_indexes,
+                                                      workers=options['workers'])
         print(f"Len of usr: $ {user_vectors.shape}")
         print(f"Len of items: ${item_vectors.shape}")
-        self.save_matrices(user_vectors, item_vectors)
-
-        ## TESTING GENERATE RECOMMENDATIONS FUNCTION -- DELETE LATERRRRRRR
-        index = 0
-
-        recommendations = generate_recommendations(User.objects.get(profile__index=index))
-
-        for index in range(50):
-            print(f'Recommendation {index}: {recommendations[index]}')
-        print('Done')
-        pass
-
-    def extract_data(self):
+        top_items = self.top_items(user_vectors, item_vectors)
+        ann = self.build_ann(item_vectors)
+        # Read last, so fewer status changes fall between this and the publish,
+        # and those that do are synced after it
+        candidates = self.candidates(item_indexes, options['chunk_size'])
+        # The version carries user_indexes, so processes serving it find user
+        # rows without the UserProfile indexes this run rewrote
+        self.save_matrices(user_vectors, item_vectors, top_items, started, ann, candidates, user_indexes)
+
+    def apply_limits(self, niceness, memory_limit_mb):
+        if niceness and hasattr(os, 'nice'):
+            os.nice(niceness)
+        if memory_limit_mb and resource is not None:
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    def extract_data(self, chunk_size=EXTRACT_CHUNK_SIZE):
         print("Extracting data...")
 
-        # Only get visits and bids for non-canceled items
-        active_items = Item.objects.exclude(status='canceled')
-        active_item_ids = set(active_items.values_list('id', flat=True))
-        
-        visits = Visited.objects.filter(item_id__in=active_item_ids).values_list('bidder__userID_id', 'item_id')
-        bids = Bid.objects.filter(item_id__in=active_item_ids).values_list('bidder__userID_id', 'item_id', 'amount')
-
-        print(f"Processing {len(visits)} visits and {len(bids)} bids...")
-
-        users = User.objects.all()
-        items = Item.objects.exclude(status='canceled')
-
-        user_ids = list(users.values_list('id', flat=True).order_by('id'))
-        item_ids = list(items.values_list('id', flat=True).order_by('id'))
-
-        # Storing indices of items and users to be able to calculate recommendations 
-        user_index = {uid: idx for idx, uid in enumerate(user_ids)}
-        item_index = {iid: idx for idx, iid in enumerate(item_ids)}
-
-        profiles = []
-
-        for user in users:
-            user.profile.index = user_index[user.id]
-            profiles.append(user.profile)
-
-        for item in items:
-            item.index = item_index[item.id]
-            
-        UserProfile.objects.bulk_update(profiles, ['index'])
-        Item.objects.bulk_update(items, ['index'])
-
-        matrix = np.zeros((len(user_ids), len(item_ids)), dtype=np.float64)
-
-        # First go through bids
-        for user_id, item_id, _ in bids:
-            matrix[user_index[user_id], item_index[item_id]] += 3 
-
-        # Then go through visits
-        for user_id, item_id in visits:
-            matrix[user_index[user_id], item_index[item_id]] += 1  
-
+        users = User.objects.order_by('id').values_list('id', flat=True)
+        # Only get visits and bids for non-cancelled items
+        items = Item.objects.exclude(status='cancelled').order_by('id').values_list('id', flat=True)
+
+        # Sorted id arrays map ids to matrix indexes with a binary search,
+        # without keeping a model instance or dict entry per row
+        user_ids = np.fromiter(users.iterator(chunk_size=chunk_size), dtype=np.int64)
+        item_ids = np.fromiter(items.iterator(chunk_size=chunk_size), dtype=np.int64)
+
+        # Storing indices of items and users to be able to calculate recommendations
+        self.assign_indexes(UserProfile.objects.all(), 'user_id', user_ids, chunk_size)
+        self.assign_indexes(Item.objects.exclude(status='cancelled'), 'id', item_ids, chunk_size)
+        # Cancelled items get no row, drop the one they may have kept from an earlier version
+        Item.objects.filter(status='cancelled', index__isnull=False).update(index=None)
+
+        # One entry per bid (weight 3) and visit (weight 1), repeated pairs are summed
+        visits = Visited.objects.exclude(item__status='cancelled').values_list('bidder__userID_id', 'item_id')
+        bids = Bid.objects.exclude(item__status='cancelled').values_list('bidder__userID_id', 'item_id')
+        rows, cols, weights = [], [], []
+        for queryset, weight in ((bids, 3.0), (visits, 1.0)):
+            for chunk in self.chunks(queryset, chunk_size):
+                user_rows, user_found = self.lookup(user_ids, chunk[:, 0])
+                item_rows, item_found = self.lookup(item_ids, chunk[:, 1])
+                # Users and items created since the ids were read have no row
+                found = user_found & item_found
+                rows.append(user_rows[found])
+                cols.append(item_rows[found])
+                weights.append(np.full(found.sum(), weight))
+            print(f"Processed {sum(map(len, weights))} bids and visits...")
+
+        shape = (len(user_ids), len(item_ids))
+        interactions = recommender.coalesce(
+            np.concatenate(rows or [np.empty(0, dtype=np.int64)]),
+            np.concatenate(cols or [np.empty(0, dtype=np.int64)]),
+            np.concatenate(weights or [np.empty(0)]),
+            shape,
+        )
 
         # Print some statistics about the matrix (Usefull for debugging and training)
-        non_zero_values = matrix[matrix > 0]
-        print(f"Matrix shape: {matrix.shape}")
-        print(f"Non-zero elements: {np.count_nonzero(matrix)}")
-        print(f"Sparsity: {(1 - np.count_nonzero(matrix) / matrix.size) * 100:.2f}%")
-        print(f"Matrix min: {matrix.min():.3f}, max: {matrix.max():.3f}, mean: {matrix.mean():.3f}")
-        if len(non_zero_values) > 0:
-            print(f"Non-zero values - min: {non_zero_values.min():.3f}, max: {non_zero_values.max():.3f}, mean: {non_zero_values.mean():.3f}")
-        
-        return matrix, user_index, item_index
-    
-    def __compute_loss(self, U, V, known_pairs, lambda_reg):
-        squared_error = 0
-        
-        for user_id, item_id, actual in known_pairs:
-            predicted = np.clip(np.dot(U[user_id], V[item_id]), -10, 10)  # Clip predictions
-            error = actual - predicted
-            
-            if not np.isfinite(error):
-                print(f'Error for predicted {predicted} and actual {actual} is {error}, terminating')
-                with open('item_log.txt', 'w') as f:
-                    f.write(' '.join(map(str, V[item_id])) + '\n')
-                    f.write(' '.join(map(str, U[user_id])) + '\n')
-                return np.inf
-                
-            squared_error += error ** 2
-
-        # Add small epsilon to prevent division by zero
-        reg = lambda_reg * (np.linalg.norm(U) ** 2 + np.linalg.norm(V) ** 2)
-        total_loss = squared_error + reg
-        
-        return total_loss if np.isfinite(total_loss) else np.inf
+        values = interactions.values
+        cells = shape[0] * shape[1]
+        print(f"Matrix shape: {shape}")
+        print(f"Non-zero elements: {len(values)}")
+        if cells:
+            matrix_min = values.min() if len(values) == cells else 0.0
+            matrix_max = values.max() if len(values) else 0.0
+            print(f"Sparsity: {(1 - len(values) / cells) * 100:.2f}%")
+            print(f"Matrix min: {matrix_min:.3f}, max: {matrix_max:.3f}, mean: {values.sum() / cells:.3f}")
+        if len(values) > 0:
+            print(f"Non-zero values - min: {values.min():.3f}, max: {values.max():.3f}, mean: {values.mean():.3f}")
+
+        return interactions, user_ids, item_ids
     
-    def sgd(self, user_matrix, item_matrix, train_pairs, validation_pairs, 
-            initial_learning_rate=0.01, reg_param=0.001, epoch=0):
-        
-        # Adaptive learning rate with more conservative decay
-        learning_rate = initial_learning_rate / (1 + 0.0001 * epoch)
-        
-        # Shuffle training pairs for better convergence
-        np.random.shuffle(train_pairs)
-
-        for (u_id, i_id, actual) in train_pairs:
-            user_val, item_val = user_matrix[u_id], item_matrix[i_id]
-
-            # Clip predictions to reasonable range
-            predicted = np.clip(np.dot(user_val, item_val), 0.5, 6.0)
-            error = actual - predicted
-
-            # Compute gradients
-            grad_u = -2 * error * item_val + 2 * reg_param * user_val
-            grad_i = -2 * error * user_val + 2 * reg_param * item_val
-            
-            # Clip gradients to prevent explosion
-            grad_u = np.clip(grad_u, -0.1, 0.1)
-            grad_i = np.clip(grad_i, -0.1, 0.1)
-
-            # Update parameters
-            user_matrix[u_id] -= learning_rate * grad_u
-            item_matrix[i_id] -= learning_rate * grad_i
-            
-            # Ensure values remain non-negative and within reasonable range
-            user_matrix[u_id] = np.clip(user_matrix[u_id], 0.001, 10.0)
-            item_matrix[i_id] = np.clip(item_matrix[i_id], 0.001, 10.0)
-
-        loss = self.__compute_loss(user_matrix, item_matrix, validation_pairs, reg_param)
-        if np.isfinite(loss) and len(validation_pairs) > 0:
-            rmse = np.sqrt(loss / len(validation_pairs))
-            print(f"Epoch {epoch}: RMSE = {rmse:.4f}, Learning Rate = {learning_rate:.6f}")
-        else:
-            print(f"Epoch {epoch}: Loss became infinite, stopping training")
-            return None, None
-
-        return user_matrix, item_matrix
-
-    def train_model(self, data, usr_indx, itm_indx, latent_factors=5, epoch_num=100):
-        """Train a matrix factorization model using SGD."""
-
-        num_users, num_items = data.shape
-        num_features = latent_factors
+    def chunks(self, queryset, chunk_size):
+        """Streams a values_list queryset as 2-d int64 arrays of at most chunk_size rows."""
+        rows = iter(queryset.iterator(chunk_size=chunk_size))
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield np.array(chunk, dtype=np.int64)
+
+    def lookup(self, ids, values):
+        """Positions of values in the sorted ids array, and which of the values are in it."""
+        if not len(ids):
+            return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+        positions = np.minimum(np.searchsorted(ids, values), len(ids) - 1)
+        return positions, ids[positions] == values
+
+    def assign_indexes(self, queryset, id_field, ids, chunk_size):
+        """
+        Stores the position of each row's id_field in the sorted ids array as
+        its index, writing only the rows whose index changed, one chunk at a time.
+        Rows whose id_field is not in ids, created since ids was read, get no index.
+        """
+        model = queryset.model
+        rows = queryset.order_by('pk').values_list('pk', id_field, Coalesce('index', -1))
+        changed = 0
+        for chunk in self.chunks(rows, chunk_size):
+            positions, found = self.lookup(ids, chunk[:, 1])
+            positions = np.where(found, positions, -1)
+            stale = chunk[:, 2] != positions
+            updates = [model(pk=int(pk), index=int(index) if index >= 0 else None)
+                       for pk, index in zip(chunk[stale, 0], positions[stale])]
+            model.objects.bulk_update(updates, ['index'], batch_size=chunk_size)
+            changed += len(updates)
+        print(f"Updated {changed} {model._meta.verbose_name} indexes")
+
+    def train_model(self, interactions, usr_indx, itm_indx, latent_factors=recommender.LATENT_FACTORS,
+                    epoch_num=recommender.EPOCHS, workers=1):
+        """Train a matrix factorization model using mini-batch SGD."""
+
+        if not len(interactions.values):
+            print("No training data available!")
 
-        # Initialize based on non-zero values - proper scale for [1.25, 5.0] range
-        non_zero_values = data[data > 0]
-        if len(non_zero_values) > 0:
-            # Scale initialization to produce predictions in the right range
-            scale = np.sqrt(non_zero_values.mean() / num_features)  # ~0.66 for mean=2.175, factors=5
-        else:
-            scale = 0.5  # fallback
-            
-        np.random.seed(42)
-        user_matrix = np.random.uniform(low=0.1, high=scale, size=(num_users, num_features))
-        item_matrix = np.random.uniform(low=0.1, high=scale, size=(num_items, num_features))
-
-        print('Starting training with proper sparse matrix handling...')
-        
-        known_pairs = []
-        u, i = np.nonzero(data)
-        known_pairs = list(zip(u, i, data[u, i]))
-
-        # Store non-zero data statistics
-        non_zero_values = data[data > 0]
-        if len(non_zero_values) > 0:
-            self._non_zero_mean = non_zero_values.mean()
+        def report(epoch, rmse, learning_rate):
+            print(f"Epoch {epoch + 1}/{epoch_num}: RMSE = {rmse:.4f}, Learning Rate = {learning_rate:.6f}")
+
+        print(f'Starting training on {len(interactions.values)} interactions with {workers} worker(s)...')
+        return recommender.train(interactions, latent_factors=latent_factors, epochs=epoch_num,
+                                 on_epoch=report, workers=workers)
+
+    def active_items(self, item_vectors):
+        """(id, index) rows of the active items that have a vector."""
+        return np.array(
+            Item.objects.filter(status='active', index__isnull=False, index__lt=len(item_vectors))
+            .values_list('id', 'index'),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+
+    def top_items(self, user_vectors, item_vectors, rows=None):
+        """Top-N active item ids for every user index (or the given ones), padded with -1."""
+        candidates = self.active_items(item_vectors)
+        top_n = vector_store.config['TOP_N']
+        positions = recommender.top_n(user_vectors, item_vectors[candidates[:, 1]], top_n, rows=rows)
+        # Items that close later, and sellers' own items, are filtered out at read time
+        return np.where(positions >= 0, candidates[positions, 0], -1)
+
+    def build_ann(self, item_vectors):
+        """IVF index over the active items, for catalogs too large to score exactly per request."""
+        rows = self.active_items(item_vectors)[:, 1]
+        if len(rows) < vector_store.config['ANN_MIN_ITEMS']:
+            return None
+        started = time.perf_counter()
+        ann = recommender.build_ivf(item_vectors, rows, n_lists=vector_store.config['ANN_LISTS'])
+        print(f"Built IVF index with {len(ann.centroids)} lists over {len(rows)} items "
+              f"in {time.perf_counter() - started:.1f} s")
+        return ann
+
+    def candidates(self, item_ids, chunk_size=EXTRACT_CHUNK_SIZE):
+        """Active flags and seller user ids aligned to the item indexes, for filtering at read time."""
+        active = np.zeros(len(item_ids), dtype=bool)
+        sellers = np.full(len(item_ids), -1, dtype=np.int64)
+        if not len(item_ids):
+            return Candidates(item_ids, active, sellers)
+        rows = Item.objects.order_by('pk').values_list(
+            'pk', 'seller__userID_id', Case(When(status='active', then=Value(1)), default=Value(0)))
+        for chunk in self.chunks(rows, chunk_size):
+            # Cancelled items, and items created since the data was extracted, have no index
+            positions, indexed = self.lookup(item_ids, chunk[:, 0])
+            sellers[positions[indexed]] = chunk[indexed, 1]
+            active[positions[indexed]] = chunk[indexed, 2] == 1
+        print(f"{active.sum()} of {len(item_ids)} indexed items are active")
+        return Candidates(item_ids, active, sellers)
+
+    def refresh_lists(self, started):
+        vectors = vector_store.current()
+        if vectors is None or vectors.top_items is None:
+            print("No precomputed lists to refresh, run a full training first")
+            return
+
+        since = datetime.fromtimestamp(vectors.manifest['lists_updated_at'], tz=dt_timezone.utc)
+        active_users = set(Bid.objects.filter(time__gt=since).values_list('bidder__userID_id', flat=True))
+        active_users |= set(Visited.objects.filter(visited_at__gt=since).values_list('bidder__userID_id', flat=True))
+        if vectors.user_ids is not None:
+            user_rows = [vector_store.user_row(vectors, user_id) for user_id in active_users]
         else:
-            print("No training data available!")
-            return user_matrix, item_matrix
-
-        best_loss = np.inf
-        patience = 10
-        no_improvement_count = 0
-
-        for epoch in range(epoch_num):
-            print(f'\nEpoch {epoch + 1}/{epoch_num}:')
-            
-            # Split data differently each epoch
-            train_pairs, val_pairs = train_test_split(
-                known_pairs, 
-                test_size=0.2, 
-                random_state=42 + epoch
-            )
-
-            result = self.sgd(user_matrix, item_matrix, train_pairs, val_pairs, epoch=epoch)
-            
-            if result[0] is None:  # Training failed due to overflow
-                print("Training stopped due to numerical instability")
-                break
-                
-            user_matrix, item_matrix = result
-            
-            # Early stopping based on validation loss
-            current_loss = self.__compute_loss(user_matrix, item_matrix, val_pairs, 0.001)
-            if current_loss < best_loss:
-                best_loss = current_loss
-                no_improvement_count = 0
-            else:
-                no_improvement_count += 1
-                
-            if no_improvement_count >= patience:
-                print(f"Early stopping at epoch {epoch + 1}")
-                break
-
-        return user_matrix, item_matrix
-
-    def save_matrices(self, user_matrix, item_matrix):
-        # Create directory if it doesn't exist
-        os.makedirs('data/latent_vectors', exist_ok=True)
-        
-        np.save(ROOT_PATH + '/data/latent_vectors/users.npy', user_matrix)
-        np.save(ROOT_PATH + '/data/latent_vectors/items.npy', item_matrix)
-        print("Matrices saved successfully!")
-        return True
\ No newline at end of file
+            # Versions written before they carried their user ids
+            user_rows = UserProfile.objects.filter(user_id__in=active_users).values_list('index', flat=True)
+        # Users who joined after the last training have no list yet
+        rows = np.array(sorted(
+            row for row in user_rows if row is not None and row < len(vectors.top_items)
+        ), dtype=np.int64)
+
+        lists = self.top_items(vectors.users, vectors.items, rows=rows)
+        if not vector_store.publish_lists(vectors, rows, lists, started):
+            print("A new model was published meanwhile, nothing to refresh")
+            return
+        print(f"Refreshed the lists of {len(rows)} users")
+
+    def save_matrices(self, user_matrix, item_matrix, top_items=None, lists_updated_at=None, ann=None,
+                      candidates=None, user_ids=None):
+        # Web processes pick up the new version on their next check of the manifest
+        version = vector_store.publish(user_matrix, item_matrix, top_items, lists_updated_at, ann, candidates,
+                                       user_ids)
+        print(f"Matrices saved successfully as version {version}!")
+        if candidates is not None:
+            # Items closed or published since the candidate arrays were read
+            vector_store.sync_items_active(version, lambda: np.fromiter(
+                Item.objects.filter(status='active').values_list('pk', flat=True), dtype=np.int64))
+        return True
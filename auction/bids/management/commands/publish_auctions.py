@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from bids.models import Item
+from bids.lifecycle import publish_due_items
+
+
+class Command(BaseCommand):
+    help = 'Publish every pending auction whose start time has passed, in a single UPDATE.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many auctions are due')
+        parser.add_argument('--verbose-ids', action='store_true',
+                            help='Print the ids of the published auctions')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['dry_run']:
+            due = Item.objects.filter(status='pending', started__lte=now).count()
+            self.stdout.write(f'{due} auctions are due for publishing')
+            return
+
+        start_time = time.time()
+        published = publish_due_items(now)
+        if options['verbose_ids']:
+            self.stdout.write(' '.join(map(str, published)))
+        self.stdout.write(self.style.SUCCESS(
+            f'Published {len(published)} auctions in {time.time() - start_time:.2f} seconds'))
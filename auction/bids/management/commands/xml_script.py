@@ -201,6 +201,7 @@ class Command(BaseCommand):
             item.save()
 
             num_of_bids = 0
+            leading_bid = None
 
             for bid_elem in item_elem.findall('Bids/Bid'):
                 bidder_user, _ = get_or_create_user_seller(bid_elem.find('Bidder').get('UserID'))
@@ -215,10 +216,15 @@ class Command(BaseCommand):
 
                 bidder = get_or_create_bidder(bidder_user, country, location)
                 bid_amount = parse_number(bid_elem.findtext('Amount')[1:])
-                Bid.objects.create(item=item, bidder=bidder, amount=bid_amount)
+                bid = Bid.objects.create(item=item, bidder=bidder, amount=bid_amount)
+                if leading_bid is None or bid.amount > leading_bid.amount:
+                    leading_bid = bid
                 num_of_bids += 1
 
             item.number_of_bids = num_of_bids
+            if leading_bid is not None:
+                item.leading_bid = leading_bid
+                item.leading_bidder = leading_bid.bidder
             item.save()
             count =  count + 1
             print(count)
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from django.utils import timezone
+from bids.scheduler_config import scheduler_config
+from bids.models import Item
+
+logger = logging.getLogger(__name__)
+
+
+class JobRun:
+    """One execution of a scheduler job, filled in by the job while it runs."""
+
+    def __init__(self, job):
+        self.job = job
+        self.items = 0
+        self.lateness = []
+        # Jobs that leave work behind report it here, see SchedulerMetrics.backlog
+        self.backlog = None
+        self.error = None
+
+
+class SchedulerMetrics:
+    """
+    Per-job counters for the background scheduler: runs, errors, duration,
+    items processed and how late auctions closed relative to Item.ends.
+    The close job also reports the overdue active items it left behind.
+    Every run emits one JSON log line and rewrites a snapshot file, so the
+    API can report the leader's numbers from any worker process.
+    """
+
+    def __init__(self):
+        self.config = scheduler_config()
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, job):
+        run = JobRun(job)
+        started = time.perf_counter()
+        try:
+            yield run
+        finally:
+            self._record(run, time.perf_counter() - started)
+
+    def _record(self, run, duration):
+        with self._lock:
+            stats = self._jobs.setdefault(run.job, {
+                'runs': 0, 'errors': 0, 'items_processed': 0,
+                'total_duration_ms': 0.0, 'max_duration_ms': 0.0, 'max_lateness_seconds': 0.0,
+                'last_run_at': None, 'last_duration_ms': None, 'last_items': None,
+                'last_lateness_seconds': None, 'last_error': None,
+            })
+            duration_ms = round(duration * 1000, 1)
+            stats['runs'] += 1
+            stats['items_processed'] += run.items
+            stats['total_duration_ms'] = round(stats['total_duration_ms'] + duration_ms, 1)
+            stats['max_duration_ms'] = max(stats['max_duration_ms'], duration_ms)
+            stats['last_run_at'] = timezone.now().isoformat()
+            stats['last_duration_ms'] = duration_ms
+            stats['last_items'] = run.items
+            if run.lateness:
+                lateness = {
+                    'mean': round(sum(run.lateness) / len(run.lateness), 3),
+                    'max': round(max(run.lateness), 3),
+                }
+                stats['last_lateness_seconds'] = lateness
+                stats['max_lateness_seconds'] = max(stats['max_lateness_seconds'], lateness['max'])
+            if run.backlog is not None:
+                stats['last_backlog'] = run.backlog
+            if run.error is not None:
+                stats['errors'] += 1
+                stats['last_error'] = run.error
+
+            line = {'job': run.job, 'duration_ms': duration_ms, 'items': run.items, 'error': run.error}
+            if run.lateness:
+                line['lateness_seconds'] = stats['last_lateness_seconds']
+            if run.backlog is not None:
+                line['backlog'] = run.backlog
+            logger.info(json.dumps(line))
+            self._write(self.snapshot())
+
+    def snapshot(self):
+        return {
+            'pid': os.getpid(),
+            'updated_at': timezone.now().isoformat(),
+            'jobs': {job: dict(stats) for job, stats in self._jobs.items()},
+        }
+
+    def _write(self, snapshot):
+        path = os.fspath(self.config['METRICS_PATH'])
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.warning(f"Could not write scheduler metrics to {path}: {e}")
+
+    def read(self):
+        """
+        Returns the last snapshot written by the scheduler leader, plus the
+        current backlog of active items that are already past their end time.
+        """
+        try:
+            with open(self.config['METRICS_PATH']) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            snapshot = {'pid': None, 'updated_at': None, 'jobs': {}}
+        snapshot['backlog'] = self.backlog()
+        return snapshot
+
+    def backlog(self):
+        """Active items that are already past their end time, and how long the oldest has waited."""
+        now = timezone.now()
+        overdue = Item.objects.filter(status='active', ends__lte=now)
+        oldest = overdue.order_by('ends').values_list('ends', flat=True).first()
+        return {
+            'overdue_items': overdue.count(),
+            'oldest_overdue_seconds': round((now - oldest).total_seconds(), 3) if oldest else 0,
+        }
+
+
+metrics = SchedulerMetrics()
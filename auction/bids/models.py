@@ -1,9 +1,11 @@
 from django.db import models
+from django.db.models import Q
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django_countries.fields import CountryField 
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from PIL import Image
 from decimal import *
 import os
@@ -52,6 +54,9 @@ class Item(models.Model):
     description = models.TextField()
     status = models.CharField(max_length=20, choices=ITEM_STATUS_CHOICES)
     index = models.PositiveIntegerField(null=True, default=None)
+    # Maintained by bid acceptance (bids.bidding) so the winner is a primary key lookup
+    leading_bid = models.ForeignKey("Bid", related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    leading_bidder = models.ForeignKey("Bidder", related_name='leading_items', null=True, blank=True, on_delete=models.SET_NULL)
     main_image = models.ImageField(
         upload_to=item_main_image_path,
         default=get_default_item_main_image,
@@ -59,6 +64,14 @@ class Item(models.Model):
         null=True,
         help_text="Main display image for the item"
     )
+
+    class Meta:
+        indexes = [
+            # Closing (scheduler, lifecycle), ending_soon and the listing ordered by end time
+            models.Index(fields=['status', 'ends'], name='item_status_ends_idx'),
+            # Publishing; only the few pending items are indexed
+            models.Index(fields=['started'], condition=Q(status='pending'), name='item_pending_started_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -75,29 +88,39 @@ class Item(models.Model):
 
         self.status = 'active'
         self.started = timezone.now()
-        self.save()
+        self.save(update_fields=['status', 'started'])
+
+    def get_leading_bid(self):
+        if self.leading_bid_id is not None:
+            return self.leading_bid
+        # Items whose bids predate the leading bid pointer
+        return self.bids.order_by('-amount', 'time').first()
 
     def close(self):
+        # Only the status is written so bids accepted after this instance was
+        # loaded are never overwritten
         if self.number_of_bids == 0:
             now = timezone.now()
             if self.ends <= now:
                 self.status = 'expired'
             else:
                 self.status = 'cancelled'
-            self.save()
+            self.save(update_fields=['status'])
             return True
         self.status = 'sold'
-        self.save()
+        self.save(update_fields=['status'])
 
-        try:
-            bid = Bid.objects.get(amount=self.current_bid, item=self.id)
-        except:
+        bid = self.get_leading_bid()
+        if bid is None:
             return False
 
         try:
-            WinningPair.objects.create(item=self, winning_bid=bid, winning_bidder=bid.bidder)
+            # A savepoint, so a pair another close created first does not
+            # break the transaction close() may be running in
+            with transaction.atomic():
+                WinningPair.objects.create(item=self, winning_bid=bid, winning_bidder_id=bid.bidder_id)
             return True
-        except:
+        except IntegrityError:
             return False
 
 
@@ -174,6 +197,28 @@ class Bid(models.Model):
     time = models.DateTimeField(auto_now=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal(0.01))])
 
+    class Meta:
+        indexes = [
+            # An item's bids from the highest, earliest first: the leading bid and the bid book
+            models.Index(fields=['item', '-amount', 'time'], name='bid_item_amount_idx'),
+        ]
+
+class ProxyBid(models.Model):
+    """
+    A bidder's maximum for an item. The server bids on the bidder's behalf,
+    up to max_amount, whenever someone else takes the lead.
+    """
+    item = models.ForeignKey("Item", related_name='proxy_bids', on_delete=models.CASCADE)
+    bidder = models.ForeignKey("Bidder", related_name='proxy_bids', on_delete=models.CASCADE)
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal(0.01))])
+    # When max_amount last changed: equal maximums go to the one set first
+    max_set_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('item', 'bidder')
+
 class Location(models.Model):
     address = models.CharField(max_length=200)
     latitude = models.FloatField( 
@@ -268,6 +313,14 @@ class Message(models.Model):
     sent_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # A conversation in order
+            models.Index(fields=['winning_pair', 'sent_at'], name='message_pair_sent_idx'),
+            # A user's unread messages, newest first
+            models.Index(fields=['recipient', '-sent_at'], condition=Q(is_read=False), name='message_unread_idx'),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender.username} to {self.recipient.username} at {self.sent_at} about {self.winning_pair.item.name}"
 
@@ -278,4 +331,8 @@ class Visited(models.Model):
 
     class Meta:
         ordering = ['-visited_at']  # Order by most recent visit first
+        indexes = [
+            # The ten minute de-duplication in ItemViewSet.record_visit
+            models.Index(fields=['bidder', 'item', '-visited_at'], name='visited_bidder_item_idx'),
+        ]
 
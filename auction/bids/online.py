@@ -0,0 +1,105 @@
+import logging
+import queue
+import threading
+import time
+from django.db import close_old_connections
+from django.db.models import Count
+from bids import recommender
+from bids.models import Bid, Bidder, Visited
+from bids.vectors import vector_store
+
+logger = logging.getLogger(__name__)
+
+# Interaction values, as extract_data weighs them for training
+BID_WEIGHT = 3
+VISIT_WEIGHT = 1
+
+
+class OnlineUpdater:
+    """
+    Folds new bids and visits into the bidder's latent vector between full
+    trainings. Writes only enqueue the event; a background thread collects
+    events for ONLINE_UPDATE_INTERVAL seconds, then takes a few gradient steps
+    on each user's row against the fixed item vector and writes it into the
+    shared mapping of the current model, so every process sees the new
+    vector. Users who have no row in that model get a spare row first.
+
+    Rows are looked up in the model's own id arrays, never through
+    UserProfile.index or Item.index: a training run rewrites those when it
+    starts, long before its model replaces the one being updated here.
+    """
+
+    def __init__(self, store=vector_store):
+        self.store = store
+        self.enabled = store.config['ONLINE_UPDATES']
+        self.interval = store.config['ONLINE_UPDATE_INTERVAL']
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def record(self, bidder_id, item_id):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put((bidder_id, item_id))
+
+    def _run(self):
+        while True:
+            events = [self._queue.get()]
+            time.sleep(self.interval)
+            while not self._queue.empty():
+                events.append(self._queue.get_nowait())
+            try:
+                self.apply(events)
+            except Exception as e:
+                logger.error(f"Error applying {len(events)} online recommendation updates: {e}")
+            finally:
+                close_old_connections()
+
+    def apply(self, events):
+        vectors = self.store.current()
+        if vectors is None or vectors.user_ids is None or vectors.candidates is None:
+            return 0  # No model yet, or one written before versions carried their id arrays
+        users = self.store.writable_users(vectors)
+        if users is None:
+            return 0
+
+        pairs = set(events)
+        user_by_bidder = dict(Bidder.objects.filter(id__in={b for b, _ in pairs}).values_list('id', 'userID_id'))
+
+        # The pairs' values as training would see them now
+        targets = dict.fromkeys(pairs, 0)
+        for model, weight in ((Bid, BID_WEIGHT), (Visited, VISIT_WEIGHT)):
+            counts = (model.objects.filter(bidder_id__in={b for b, _ in pairs}, item_id__in={i for _, i in pairs})
+                      .values_list('bidder_id', 'item_id').annotate(count=Count('id')).order_by())
+            for bidder_id, item_id, count in counts:
+                if (bidder_id, item_id) in targets:
+                    targets[(bidder_id, item_id)] += weight * count
+
+        updated = 0
+        for bidder_id, item_id in pairs:
+            user_id = user_by_bidder.get(bidder_id)
+            item_row = self.store.item_row(vectors, item_id)
+            if user_id is None or item_row is None:
+                continue  # A deleted bidder, or an item created after training
+            row = self.store.user_row(vectors, user_id)
+            if row is None:
+                row = self.assign_row(vectors, user_id)
+            if row is None:
+                continue
+
+            users[row] = recommender.fold_in(users[row], vectors.items[item_row], targets[(bidder_id, item_id)])
+            updated += 1
+        return updated
+
+    def assign_row(self, vectors, user_id):
+        row = self.store.allocate_user_row(vectors, user_id)
+        if row is None:
+            logger.warning("No spare user rows left for online updates until the next training")
+        return row
+
+
+online_updater = OnlineUpdater()
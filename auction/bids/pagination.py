@@ -0,0 +1,144 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import F, Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page number pagination that switches to keyset (cursor) pagination when
+    the request has a cursor parameter; ?cursor= asks for the first page.
+
+    A keyset page filters on the position of the previous page's last row,
+    (ordering field, id), instead of skipping rows with OFFSET, and does not
+    count the whole queryset, so every page costs the same as the first.
+    Responses then carry next/previous cursor links and no count. Rows
+    with a null ordering value come last in both directions.
+
+    Querysets of model instances and of values() rows both work. The
+    queryset's ordering must be a single field of the model, optionally
+    followed by the primary key; an unordered queryset is keyed on the
+    view's ordering or else on the primary key alone. Orderings the keyset
+    cannot follow (expressions, relations, several fields) and lists that
+    are not querysets keep page numbers.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = False
+        ordering = None
+        if self.cursor_query_param in request.query_params and isinstance(queryset, QuerySet):
+            ordering = self.get_keyset_ordering(queryset, view)
+        if ordering is None:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        self.field, self.descending = ordering
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[2]
+
+        queryset = queryset.order_by(*self.get_order_by(reverse))
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor[0], cursor[1], reverse))
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        # A cursor always points back at the page it came from
+        has_next = has_more if not reverse else True
+        has_previous = has_more if reverse else cursor is not None
+        self.next_cursor = self.position(rows[-1], False) if rows and has_next else None
+        self.previous_cursor = self.position(rows[0], True) if rows and has_previous else None
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_cursor_link(self.next_cursor),
+            'previous': self.get_cursor_link(self.previous_cursor),
+            'results': data,
+        })
+
+    def get_keyset_ordering(self, queryset, view):
+        """(model field, descending) of the ordering the keyset follows, or None when it cannot follow it."""
+        model = queryset.model
+        ordering = queryset.query.order_by or model._meta.ordering or getattr(view, 'ordering', None) or ['pk']
+        if isinstance(ordering, str):
+            ordering = [ordering]
+        if not all(isinstance(name, str) for name in ordering):
+            return None
+
+        pk_names = ('pk', model._meta.pk.name)
+        fields = [name for name in ordering if name.lstrip('-') not in pk_names] or ordering[:1]
+        if len(fields) != 1:
+            return None
+        name = fields[0].lstrip('-')
+        try:
+            field = model._meta.pk if name in pk_names else model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.is_relation:
+            return None
+        return field, fields[0].startswith('-')
+
+    def get_order_by(self, reverse):
+        descending = self.descending != reverse
+        # Nulls last going forward, so first when walking back
+        nulls = {'nulls_first' if reverse else 'nulls_last': True} if self.field.null else {}
+        field = F(self.field.name)
+        return field.desc(**nulls) if descending else field.asc(**nulls), '-pk' if descending else 'pk'
+
+    def after(self, value, pk, reverse):
+        """Rows that follow the (value, pk) position in the direction of travel."""
+        name = self.field.name
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        following = Q(**{f'{name}__{lookup}': value}) | Q(**{name: value, f'pk__{lookup}': pk})
+        if not self.field.null:
+            return following
+        nulls = Q(**{f'{name}__isnull': True})
+        if value is None:
+            # Within the nulls only the primary key orders rows
+            tail = nulls & Q(**{f'pk__{lookup}': pk})
+            return tail | ~nulls if reverse else tail
+        return following if reverse else following | nulls
+
+    def position(self, row, reverse):
+        if isinstance(row, dict):
+            # A values() row, which has to include the ordering field and the primary key
+            meta = self.field.model._meta
+            row = self.field.model(**{self.field.attname: row[self.field.attname], 'pk': row[meta.pk.attname]})
+        value = getattr(row, self.field.attname)
+        value = None if value is None else self.field.value_to_string(row)
+        payload = json.dumps([value, row.pk, reverse], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk, reverse = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if pk is None:
+                raise ValueError('Cursor without a primary key')
+            if value is not None:
+                value = self.field.to_python(value)
+            return value, self.field.model._meta.pk.to_python(pk), bool(reverse)
+        except (binascii.Error, ValueError, TypeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
@@ -0,0 +1,339 @@
+import multiprocessing
+from collections import namedtuple
+from contextlib import nullcontext
+from multiprocessing import shared_memory
+import numpy as np
+
+LATENT_FACTORS = 5
+EPOCHS = 100
+PATIENCE = 10
+LEARNING_RATE = 0.01
+REG_PARAM = 0.001
+BATCH_SIZE = 4096
+ONLINE_STEPS = 3
+ONLINE_LEARNING_RATE = 0.05
+VALIDATION_SHARE = 0.2
+TOP_N_BLOCK_CELLS = 1 << 24  # Scores held in memory at once by top_n, 128 MB of float64
+
+# Inverted-file index over item vectors: item rows grouped by their nearest
+# centroid, list l holding rows[offsets[l]:offsets[l + 1]]
+IVFIndex = namedtuple('IVFIndex', ['centroids', 'offsets', 'rows'])
+
+# Sparse (COO) users x items interaction matrix: one entry per user/item pair
+# that has any activity, so memory grows with the activity and not the catalog
+Interactions = namedtuple('Interactions', ['users', 'items', 'values', 'shape'])
+
+
+def coalesce(users, items, weights, shape):
+    """
+    Builds Interactions from parallel index/weight arrays, summing the
+    weights of repeated (user, item) pairs. Entries come out sorted by user,
+    then item.
+    """
+    num_items = shape[1]
+    keys = np.asarray(users, dtype=np.int64) * num_items + np.asarray(items, dtype=np.int64)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    values = np.bincount(inverse, weights=weights, minlength=len(keys))
+    return Interactions(keys // num_items, keys % num_items, values, shape)
+
+
+def init_factors(num_users, num_items, values, latent_factors=LATENT_FACTORS, seed=42):
+    """Random non-negative factors scaled so that initial predictions are near the mean rating."""
+    scale = np.sqrt(values.mean() / latent_factors) if len(values) else 0.5
+    rng = np.random.RandomState(seed)
+    user_matrix = rng.uniform(low=0.1, high=scale, size=(num_users, latent_factors))
+    item_matrix = rng.uniform(low=0.1, high=scale, size=(num_items, latent_factors))
+    return user_matrix, item_matrix
+
+
+def predict(user_matrix, item_matrix, users, items):
+    return np.einsum('ij,ij->i', user_matrix[users], item_matrix[items])
+
+
+def loss(user_matrix, item_matrix, users, items, values, reg_param=REG_PARAM):
+    """Squared error of the clipped predictions plus L2 regularisation."""
+    error = values - np.clip(predict(user_matrix, item_matrix, users, items), -10, 10)
+    reg = reg_param * (np.linalg.norm(user_matrix) ** 2 + np.linalg.norm(item_matrix) ** 2)
+    total = np.dot(error, error) + reg
+    return total if np.isfinite(total) else np.inf
+
+
+def rmse(user_matrix, item_matrix, users, items, values):
+    error = values - np.clip(predict(user_matrix, item_matrix, users, items), 0.5, 6.0)
+    return float(np.sqrt(np.mean(error ** 2))) if len(values) else 0.0
+
+
+def sgd_epoch(user_matrix, item_matrix, users, items, values, learning_rate=LEARNING_RATE,
+              reg_param=REG_PARAM, batch_size=BATCH_SIZE, rng=np.random):
+    """
+    One pass of stochastic gradient descent over the interactions, in shuffled
+    mini-batches. Each batch gathers its user and item rows, computes all
+    predictions and clipped gradients at once and scatter-adds the per-pair
+    updates back, so a row that occurs several times in a batch receives the
+    sum of its updates, as it would pair by pair. Updates the matrices in place.
+    """
+    order = rng.permutation(len(values))
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        u, i = users[batch], items[batch]
+        user_rows, item_rows = user_matrix[u], item_matrix[i]
+
+        predicted = np.clip(np.einsum('ij,ij->i', user_rows, item_rows), 0.5, 6.0)
+        error = (values[batch] - predicted)[:, None]
+
+        grad_u = np.clip(-2 * error * item_rows + 2 * reg_param * user_rows, -0.1, 0.1)
+        grad_i = np.clip(-2 * error * user_rows + 2 * reg_param * item_rows, -0.1, 0.1)
+
+        np.add.at(user_matrix, u, -learning_rate * grad_u)
+        np.add.at(item_matrix, i, -learning_rate * grad_i)
+
+        # Keep the factors non-negative and bounded, touching only the updated rows
+        user_matrix[u] = np.clip(user_matrix[u], 0.001, 10.0)
+        item_matrix[i] = np.clip(item_matrix[i], 0.001, 10.0)
+
+
+class HogwildSGD:
+    """
+    Lock-free parallel SGD in the style of Hogwild!. The factor matrices and
+    the interactions are placed in shared memory. Every epoch the shuffled
+    interactions are split into one shard per worker process, and each worker
+    runs sgd_epoch on its shard, writing to the shared matrices without locks.
+    Interactions are sparse, so two workers rarely update the same row at the
+    same time, and the occasional lost update does not hurt convergence.
+
+    Use it as a context manager; the worker pool and the shared memory are
+    released on exit, so copy user_matrix and item_matrix out before then.
+    """
+
+    def __init__(self, user_matrix, item_matrix, interactions, workers):
+        self.workers = workers
+        self._blocks = []
+        arrays, specs = {}, {}
+        for name, array in (('user_matrix', user_matrix), ('item_matrix', item_matrix),
+                            ('users', interactions.users), ('items', interactions.items),
+                            ('values', interactions.values), ('order', interactions.users)):
+            array = np.asarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self._blocks.append(block)
+            arrays[name] = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            arrays[name][...] = array
+            specs[name] = (block.name, array.shape, array.dtype.str)
+        self.user_matrix, self.item_matrix = arrays['user_matrix'], arrays['item_matrix']
+        self._order = arrays['order']
+        self._pool = multiprocessing.Pool(workers, initializer=_attach_shared, initargs=(specs,))
+
+    def epoch(self, fit, learning_rate=LEARNING_RATE, reg_param=REG_PARAM, batch_size=BATCH_SIZE, seed=0):
+        """One pass over the interactions at the given positions, split evenly across the workers."""
+        self._order[:len(fit)] = fit
+        bounds = np.linspace(0, len(fit), self.workers + 1).astype(np.int64)
+        self._pool.starmap(_sgd_shard, [
+            (int(start), int(stop), learning_rate, reg_param, batch_size, (seed, worker))
+            for worker, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))
+        ])
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+        self.user_matrix = self.item_matrix = self._order = None
+        for block in self._blocks:
+            try:
+                block.close()
+            except BufferError:
+                # A caller still holds a view; the memory goes once it is dropped
+                pass
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_shared = None
+
+
+def _attach_shared(specs):
+    """Pool initializer: maps the arrays HogwildSGD placed in shared memory."""
+    global _shared
+    blocks = [shared_memory.SharedMemory(name=spec[0]) for spec in specs.values()]
+    arrays = {name: np.ndarray(shape, dtype=dtype, buffer=block.buf)
+              for block, (name, (_, shape, dtype)) in zip(blocks, specs.items())}
+    _shared = blocks, arrays
+
+
+def _sgd_shard(start, stop, learning_rate, reg_param, batch_size, seed):
+    arrays = _shared[1]
+    shard = arrays['order'][start:stop]
+    sgd_epoch(arrays['user_matrix'], arrays['item_matrix'],
+              arrays['users'][shard], arrays['items'][shard], arrays['values'][shard],
+              learning_rate=learning_rate, reg_param=reg_param, batch_size=batch_size,
+              rng=np.random.RandomState(seed))
+
+
+def fold_in(user_vector, item_vector, target, steps=ONLINE_STEPS, learning_rate=ONLINE_LEARNING_RATE,
+            reg_param=REG_PARAM):
+    """
+    Moves one user vector towards a new interaction value with a few SGD
+    steps against a fixed item vector, under the same clipping as training.
+    Returns the updated vector.
+    """
+    user_vector = np.array(user_vector, dtype=np.float64)
+    item_vector = np.asarray(item_vector, dtype=np.float64)
+    for _ in range(steps):
+        error = target - np.clip(np.dot(user_vector, item_vector), 0.5, 6.0)
+        grad = np.clip(-2 * error * item_vector + 2 * reg_param * user_vector, -0.1, 0.1)
+        user_vector = np.clip(user_vector - learning_rate * grad, 0.001, 10.0)
+    return user_vector
+
+
+def train(interactions, latent_factors=LATENT_FACTORS, epochs=EPOCHS, batch_size=BATCH_SIZE,
+          on_epoch=None, workers=1):
+    """
+    Matrix factorisation of the interaction values with mini-batch SGD. Only
+    the stored (non-zero) entries are trained on. Every epoch holds
+    out a different random share for validation and training stops early
+    once the validation loss has not improved for PATIENCE epochs.
+
+    With more than one worker the epochs run in parallel processes with
+    HogwildSGD; results then vary slightly from run to run.
+
+    on_epoch(epoch, rmse, learning_rate) is called after every epoch.
+    Returns the user and item factor matrices.
+    """
+    users, items, values = interactions.users, interactions.items, interactions.values
+    user_matrix, item_matrix = init_factors(*interactions.shape, values, latent_factors)
+    if not len(values):
+        return user_matrix, item_matrix
+
+    best_loss = np.inf
+    no_improvement_count = 0
+    validation_size = int(np.ceil(len(values) * VALIDATION_SHARE))
+
+    parallel = HogwildSGD(user_matrix, item_matrix, interactions, workers) if workers > 1 else nullcontext()
+    with parallel:
+        if workers > 1:
+            user_matrix, item_matrix = parallel.user_matrix, parallel.item_matrix
+
+        for epoch in range(epochs):
+            # Split data differently each epoch
+            rng = np.random.RandomState(42 + epoch)
+            order = rng.permutation(len(values))
+            val, fit = order[:validation_size], order[validation_size:]
+
+            learning_rate = LEARNING_RATE / (1 + 0.0001 * epoch)
+            if workers > 1:
+                parallel.epoch(fit, learning_rate=learning_rate, batch_size=batch_size, seed=42 + epoch)
+            else:
+                sgd_epoch(user_matrix, item_matrix, users[fit], items[fit], values[fit],
+                          learning_rate=learning_rate, batch_size=batch_size, rng=rng)
+
+            current_loss = loss(user_matrix, item_matrix, users[val], items[val], values[val])
+            if not np.isfinite(current_loss):
+                break
+            if on_epoch is not None:
+                on_epoch(epoch, np.sqrt(current_loss / len(val)), learning_rate)
+
+            # Early stopping based on validation loss
+            if current_loss < best_loss:
+                best_loss = current_loss
+                no_improvement_count = 0
+            else:
+                no_improvement_count += 1
+            if no_improvement_count >= PATIENCE:
+                break
+
+        if workers > 1:
+            # Copy the factors out before the shared memory is released
+            user_matrix, item_matrix = user_matrix.copy(), item_matrix.copy()
+
+    return user_matrix, item_matrix
+
+
+def top_n(user_matrix, item_matrix, n, rows=None):
+    """
+    The n item rows with the highest predicted rating for each user row (or
+    for the given rows only), best first, padded with -1 when there are
+    fewer items. Users are scored in blocks that keep at most
+    TOP_N_BLOCK_CELLS scores in memory.
+    """
+    rows = np.arange(len(user_matrix)) if rows is None else np.asarray(rows)
+    result = np.full((len(rows), n), -1, dtype=np.int64)
+    k = min(n, len(item_matrix))
+    if not k:
+        return result
+
+    item_matrix = np.asarray(item_matrix)
+    block_size = max(1, TOP_N_BLOCK_CELLS // len(item_matrix))
+    for start in range(0, len(rows), block_size):
+        scores = np.asarray(user_matrix[rows[start:start + block_size]]) @ item_matrix.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else \
+            np.broadcast_to(np.arange(k), scores.shape).copy()
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+        result[start:start + len(scores), :k] = np.take_along_axis(top, order, axis=1)
+    return result
+
+
+def build_ivf(item_matrix, rows=None, n_lists=None, iterations=10, sample_size=64, seed=0):
+    """
+    Clusters the item vectors (or only the given rows) with k-means and
+    groups them by cluster. n_lists defaults to about the square root of the
+    number of items; the centroids are trained on at most sample_size items
+    per list.
+    """
+    rows = np.arange(len(item_matrix)) if rows is None else np.asarray(rows, dtype=np.int64)
+    vectors = np.asarray(item_matrix[rows], dtype=np.float64)
+    n_lists = max(1, min(n_lists or int(np.sqrt(len(rows))), len(rows)))
+
+    rng = np.random.RandomState(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), n_lists * sample_size), replace=False)]
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assigned = _nearest_centroid(sample, centroids)
+        counts = np.bincount(assigned, minlength=n_lists)
+        for factor in range(sample.shape[1]):
+            sums = np.bincount(assigned, weights=sample[:, factor], minlength=n_lists)
+            # Empty clusters keep their previous centroid
+            centroids[counts > 0, factor] = sums[counts > 0] / counts[counts > 0]
+
+    assigned = _nearest_centroid(vectors, centroids)
+    order = np.argsort(assigned, kind='stable')
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assigned, minlength=n_lists))
+    return IVFIndex(centroids, offsets, rows[order])
+
+
+def _nearest_centroid(vectors, centroids, block_size=4096):
+    # Single precision is plenty to pick a cluster and halves the memory traffic;
+    # small blocks keep the distance matrix in cache
+    vectors = vectors.astype(np.float32, copy=False)
+    centroid_norms = (centroids ** 2).sum(axis=1).astype(np.float32)
+    scaled = (-2 * centroids.T).astype(np.float32)
+    assigned = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        # |x - c|^2 without the |x|^2 term, which is the same for every centroid
+        distances = vectors[start:start + block_size] @ scaled
+        distances += centroid_norms
+        assigned[start:start + block_size] = distances.argmin(axis=1)
+    return assigned
+
+
+def search_ivf(index, item_matrix, user_vector, k, nprobe):
+    """
+    Approximate top-k item rows for one user: only the nprobe lists whose
+    centroids score highest against the user vector are scored exactly.
+    More probes give better recall at a higher cost.
+    """
+    centroid_scores = index.centroids @ user_vector
+    nprobe = min(nprobe, len(centroid_scores))
+    probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+    rows = np.concatenate([index.rows[index.offsets[l]:index.offsets[l + 1]] for l in probed])
+    if not len(rows):
+        return rows
+
+    scores = np.asarray(item_matrix[rows]) @ user_vector
+    k = min(k, len(rows))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return rows[top[np.argsort(-scores[top], kind='stable')]]
+
@@ -1,119 +1,315 @@
+import heapq
+import itertools
+import os
+import socket
 import threading
-import time
+from datetime import datetime, timedelta
 from django.utils import timezone
 from django.conf import settings
+from django.db import close_old_connections
 import logging
-from django.core.management import call_command
-from django.core.management.base import CommandError
-import io
-import sys
 from bids.models import Item
+from bids.bidbook import bid_book
+from bids.lifecycle import close_ended_items, publish_due_items
+from bids.scheduler_config import scheduler_config
+from bids.training import run_training
+from bids.metrics import metrics
 
 logger = logging.getLogger(__name__)
 MINUTE = 60
+RETRY_DELAY = timedelta(seconds=5)
+
+CLOSE = 'close'
+PUBLISH = 'publish'
+RECOMMENDATIONS = 'recommendations'
+RESYNC = 'resync'
+REFRESH_LISTS = 'refresh_lists'
 
 
 class BackgroundScheduler:
+    """
+    Deadline scheduler. Upcoming Item.ends (close) and Item.started (publish)
+    times are kept in a min-heap that is loaded once at start and updated when
+    items are saved. The scheduler thread sleeps until the earliest deadline
+    and then handles exactly the items that are due, so auctions close on
+    time and nothing is queried while no deadline is due.
+
+    Stale entries (an item whose end time moved, or that was closed already)
+    are left in the heap; the close and publish jobs re-check the database
+    state, which turns them into no-ops.
+
+    Saves in other processes send the deadlines due before the next resync
+    to the leader's inbox, a local datagram socket. Messages are not
+    acknowledged, so a resync job still periodically loads the deadlines
+    that fall within the next two resync intervals.
+    """
+
     def __init__(self):
-        self._timer_close = None
-        self._timer_publish = None
-        self._timer_recommendations = None
+        self.config = scheduler_config()
+        self._heap = []
+        self._scheduled = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._recommendations_thread = None
         self.is_running = False
 
-    def _close_items(self):
+    def schedule(self, when, job, item_id=None):
+        with self._condition:
+            if item_id is not None:
+                if self._scheduled.get((job, item_id)) == when:
+                    return
+                self._scheduled[(job, item_id)] = when
+            heapq.heappush(self._heap, (when, next(self._sequence), job, item_id))
+            self._condition.notify()
 
-        if not self.is_running:
+    def schedule_item(self, item):
+        if item.status == 'active':
+            when, job = item.ends, CLOSE
+        elif item.status == 'pending' and item.started:
+            when, job = item.started, PUBLISH
+        else:
+            return
+        if self.is_running:
+            self.schedule(when, job, item.pk)
+        elif when <= timezone.now() + 2 * timedelta(seconds=self.config['RESYNC_INTERVAL']):
+            # Later deadlines are loaded by a resync before they are due
+            self._send(when, job, item.pk)
+
+    def _send(self, when, job, item_id):
+        path = os.fspath(self.config['INBOX_PATH'] or '')
+        if not path or not hasattr(socket, 'AF_UNIX'):
             return
-            
-        current_time = timezone.now()
-        logger.info(f"Closing items at: {current_time}")
-        
         try:
-            
-            ended_items = Item.objects.filter(status='active', ends__lte=current_time)
-
-            for item in ended_items:
-                item.close()
-            
-            
-        except Exception as e:
-            logger.error(f"Error in close task: {e}")
-        
-        self._timer_close = threading.Timer(MINUTE, self._close_items)
-        self._timer_close.daemon = True
-        self._timer_close.start()
-
-    def _publish_auctions(self):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as inbox:
+                inbox.setblocking(False)
+                inbox.sendto(f'{job} {item_id} {when.isoformat()}'.encode(), path)
+        except OSError:
+            # No leader listening, or its inbox is full: the resync picks the deadline up
+            pass
 
-        if not self.is_running:
+    def _listen(self):
+        path = os.fspath(self.config['INBOX_PATH'] or '')
+        if not path or not hasattr(socket, 'AF_UNIX'):
+            return
+        inbox = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            # Left behind by a previous leader
+            if os.path.exists(path):
+                os.unlink(path)
+            inbox.bind(path)
+        except OSError as e:
+            logger.warning(f"Cannot listen on the scheduler inbox {path}, relying on resyncs: {e}")
+            inbox.close()
             return
-        
+        # Wakes up to notice stop()
+        inbox.settimeout(1)
+        threading.Thread(target=self._receive, args=(inbox,), daemon=True).start()
+
+    def _receive(self, inbox):
+        with inbox:
+            while self.is_running:
+                try:
+                    message = inbox.recv(256).decode()
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                try:
+                    job, item_id, when = message.split(' ')
+                    if job not in (CLOSE, PUBLISH):
+                        raise ValueError(job)
+                    self.schedule(datetime.fromisoformat(when), job, int(item_id))
+                except ValueError:
+                    logger.warning(f"Ignored a malformed scheduler inbox message: {message!r}")
+
+    def _load_deadlines(self, horizon=None):
+        active = Item.objects.filter(status='active')
+        pending = Item.objects.filter(status='pending', started__isnull=False)
+        if horizon is not None:
+            active = active.filter(ends__lte=horizon)
+            pending = pending.filter(started__lte=horizon)
+
+        entries = []
+        for item_id, ends in active.values_list('id', 'ends').iterator():
+            entries.append((ends, CLOSE, item_id))
+        for item_id, started in pending.values_list('id', 'started').iterator():
+            entries.append((started, PUBLISH, item_id))
+
+        loaded = 0
+        with self._condition:
+            for when, job, item_id in entries:
+                if self._scheduled.get((job, item_id)) != when:
+                    self._scheduled[(job, item_id)] = when
+                    self._heap.append((when, next(self._sequence), job, item_id))
+                    loaded += 1
+            heapq.heapify(self._heap)
+            self._condition.notify()
+        logger.info(f"Loaded {loaded} auction deadlines")
+        return loaded
+
+    def _pop_due(self):
+        with self._condition:
+            while self.is_running:
+                now = timezone.now()
+                if self._heap and self._heap[0][0] <= now:
+                    break
+                timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+                self._condition.wait(timeout)
+            due = {CLOSE: [], PUBLISH: [], RECOMMENDATIONS: [], RESYNC: [], REFRESH_LISTS: []}
+            now = timezone.now()
+            while self._heap and self._heap[0][0] <= now:
+                when, _, job, item_id = heapq.heappop(self._heap)
+                if self._scheduled.get((job, item_id)) == when:
+                    del self._scheduled[(job, item_id)]
+                due[job].append(item_id)
+            return due
+
+    def _run(self):
+        while self.is_running:
+            due = self._pop_due()
+            if not self.is_running:
+                break
+            if due[PUBLISH]:
+                self._publish_auctions(due[PUBLISH])
+            if due[CLOSE]:
+                self._close_items(due[CLOSE])
+            if due[RESYNC]:
+                self._resync()
+            if due[RECOMMENDATIONS] or due[REFRESH_LISTS]:
+                self._start_recommendations(bool(due[RECOMMENDATIONS]), bool(due[REFRESH_LISTS]))
+            close_old_connections()
+
+    def _start_recommendations(self, train, refresh):
+        if self._recommendations_thread and self._recommendations_thread.is_alive():
+            # One training process at a time, try again once it is done
+            for job, due in ((RECOMMENDATIONS, train), (REFRESH_LISTS, refresh)):
+                if due:
+                    self.schedule(timezone.now() + RETRY_DELAY, job)
+            return
+        self._recommendations_thread = threading.Thread(
+            target=self._generate_recommendations, args=(train, refresh), daemon=True)
+        self._recommendations_thread.start()
+
+    def _close_items(self, item_ids):
+
         current_time = timezone.now()
-        logger.info(f"Publishing auctions at: {current_time}")
+        logger.info(f"Closing {len(item_ids)} items at: {current_time}")
 
-        try:
-            items_toPublish = Item.objects.filter(status="pending", started__lte=current_time)
+        with metrics.track(CLOSE) as run:
+            try:
+                # Bids accepted in memory must reach the database before the items close
+                if bid_book.enabled:
+                    bid_book.flush()
+
+                closed = close_ended_items(current_time, item_ids=item_ids)
+
+                if bid_book.enabled:
+                    bid_book.discard(closed)
+
+                run.items = len(closed)
+                for ends in Item.objects.filter(id__in=closed).values_list('ends', flat=True):
+                    run.lateness.append((current_time - ends).total_seconds())
+
+                # Items whose end time moved later since they were scheduled
+                moved = Item.objects.filter(id__in=set(item_ids) - set(closed), status='active')
+                for item_id, ends in moved.values_list('id', 'ends'):
+                    self.schedule(ends, CLOSE, item_id)
+
+                # What this run left overdue goes into its log line and the snapshot
+                run.backlog = metrics.backlog()
+
+            except Exception as e:
+                logger.error(f"Error in close task: {e}")
+                run.error = str(e)
+                for item_id in item_ids:
+                    self.schedule(current_time + RETRY_DELAY, CLOSE, item_id)
+
+    def _publish_auctions(self, item_ids):
+
+        current_time = timezone.now()
+        logger.info(f"Publishing {len(item_ids)} auctions at: {current_time}")
+
+        with metrics.track(PUBLISH) as run:
+            try:
+                published = publish_due_items(current_time, item_ids=item_ids)
+                run.items = len(published)
 
-            for item in items_toPublish:
-                item.publish()
-                
-        except Exception as e:
-            logger.error(f"Error in publish task: {e}")
-        
-        self._timer_publish = threading.Timer(MINUTE, self._publish_auctions)
-        self._timer_publish.daemon = True
-        self._timer_publish.start()
+                # The bulk UPDATE sends no post_save, so schedule the closes here
+                for item_id, ends in Item.objects.filter(id__in=published).values_list('id', 'ends'):
+                    self.schedule(ends, CLOSE, item_id)
 
+            except Exception as e:
+                logger.error(f"Error in publish task: {e}")
+                run.error = str(e)
+                for item_id in item_ids:
+                    self.schedule(current_time + RETRY_DELAY, PUBLISH, item_id)
 
+    def _resync(self):
+        interval = timedelta(seconds=self.config['RESYNC_INTERVAL'])
+        with metrics.track(RESYNC) as run:
+            try:
+                run.items = self._load_deadlines(horizon=timezone.now() + 2 * interval)
+            except Exception as e:
+                logger.error(f"Error when resyncing deadlines: {e}")
+                run.error = str(e)
+        self.schedule(timezone.now() + interval, RESYNC)
 
-    def _generate_recommendations(self):
+    def _generate_recommendations(self, train=True, refresh=False):
 
         if not self.is_running:
             return
-            
+
         current_time = timezone.now()
         logger.info(f"Generating recommendations {current_time}")
-        
-        try:
-            call_command('generate_recommendations')
-            
-        except Exception as e:
-            logger.error(f"Error when generating recommendations: {e}")
-        
-        self._timer_recommendations = threading.Timer(60 * MINUTE, self._generate_recommendations)
-        self._timer_recommendations.daemon = True
-        self._timer_recommendations.start()
+
+        # Training runs in its own process, this thread only waits for it.
+        # A full training also rewrites every list, so it covers a due refresh.
+        with metrics.track(RECOMMENDATIONS if train else REFRESH_LISTS) as run:
+            try:
+                if not run_training(
+                    niceness=self.config['TRAINING_NICENESS'],
+                    memory_limit_mb=self.config['TRAINING_MEMORY_LIMIT_MB'],
+                    timeout=self.config['TRAINING_TIMEOUT'],
+                    refresh_lists=not train,
+                    workers=self.config['TRAINING_WORKERS'],
+                ):
+                    run.error = 'Training process failed'
+
+            except Exception as e:
+                logger.error(f"Error when generating recommendations: {e}")
+                run.error = str(e)
+            finally:
+                close_old_connections()
+
+        if train:
+            self.schedule(timezone.now() + timedelta(seconds=self.config['TRAINING_INTERVAL']), RECOMMENDATIONS)
+        if refresh:
+            self.schedule(timezone.now() + timedelta(seconds=self.config['LISTS_REFRESH_INTERVAL']), REFRESH_LISTS)
 
     def start(self):
         if not self.is_running:
             self.is_running = True
             logger.info("Starting background scheduler...")
-            
-            # Start close task
-            self._timer_close = threading.Timer(MINUTE, self._close_items)
-            self._timer_close.daemon = True
-            self._timer_close.start()
-
-            # Start publish task
-            self._timer_publish = threading.Timer(MINUTE, self._publish_auctions)
-            self._timer_publish.daemon = True
-            self._timer_publish.start()
-            
-            # Start hour task
-            self._timer_recommendations = threading.Timer(60 * MINUTE, self._generate_recommendations)
-            self._timer_recommendations.daemon = True
-            self._timer_recommendations.start()
-            
+
+            # Before loading, so saves made meanwhile in other processes are not missed
+            self._listen()
+            self._load_deadlines()
+            self.schedule(timezone.now() + timedelta(seconds=self.config['RESYNC_INTERVAL']), RESYNC)
+
+            # First training after one interval
+            self.schedule(timezone.now() + timedelta(seconds=self.config['TRAINING_INTERVAL']), RECOMMENDATIONS)
+            self.schedule(timezone.now() + timedelta(seconds=self.config['LISTS_REFRESH_INTERVAL']), REFRESH_LISTS)
+
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
             print("Background scheduler started successfully!")
 
     def stop(self):
-        self.is_running = False
-        if self._timer_close:
-            self._timer_close.cancel()
-        if self._timer_recommendations:
-            self._timer_recommendations.cancel()
-        if self._timer_publish:
-            self._timer_publish.cancel()
+        with self._condition:
+            self.is_running = False
+            self._condition.notify()
         logger.info("Background scheduler stopped")
 
-scheduler = BackgroundScheduler()
\ No newline at end of file
+scheduler = BackgroundScheduler()
@@ -0,0 +1,26 @@
+import os
+from django.conf import settings
+
+# Overridden by settings.SCHEDULER
+DEFAULTS = {
+    # Leader election (bids.leader)
+    'AUTOSTART': False,
+    'LOCK_PATH': os.path.join(settings.BASE_DIR, 'data', 'scheduler.lock'),
+    'LEADER_RETRY_INTERVAL': 15,
+    # Deadline heap (bids.scheduler)
+    'RESYNC_INTERVAL': 60,
+    'INBOX_PATH': os.path.join(settings.BASE_DIR, 'data', 'scheduler.sock'),
+    # Job metrics (bids.metrics)
+    'METRICS_PATH': os.path.join(settings.BASE_DIR, 'data', 'scheduler_metrics.json'),
+    # Recommendation training and lists (bids.training)
+    'TRAINING_INTERVAL': 60 * 60,
+    'TRAINING_NICENESS': 10,
+    'TRAINING_MEMORY_LIMIT_MB': None,
+    'TRAINING_TIMEOUT': 50 * 60,
+    'TRAINING_WORKERS': 1,
+    'LISTS_REFRESH_INTERVAL': 10 * 60,
+}
+
+
+def scheduler_config():
+    return {**DEFAULTS, **getattr(settings, 'SCHEDULER', {})}
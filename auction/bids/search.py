@@ -0,0 +1,204 @@
+import logging
+import re
+import threading
+import time
+from django.db import connections, transaction
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from rest_framework.settings import api_settings
+from bids.models import Item
+
+logger = logging.getLogger(__name__)
+
+# Item name matches count this many times a description match when ranking
+NAME_WEIGHT = 10.0
+
+# Seconds before a process looks again for an index it found missing
+RECHECK_INTERVAL = 60
+
+WORD = re.compile(r'\w+')
+
+
+class ItemSearchIndex:
+    """
+    Full-text index over Item.name and Item.description, built by build()
+    after every migrate, or by the build_search_index command, so no
+    migration is needed:
+
+    - SQLite: an external-content FTS5 table, kept in sync by triggers on
+      the item table and ranked with bm25.
+    - PostgreSQL: a generated tsvector column with a GIN index, ranked with
+      ts_rank.
+
+    Both answer a query from the index instead of scanning the descriptions,
+    so latency follows the number of matches rather than the catalog size.
+    Status changes such as closing an item need no index update; the status
+    is filtered on the item table. Other databases keep the LIKE search.
+
+    Building takes table locks (on PostgreSQL it adds a stored column, which
+    rewrites the item table), so requests never build: until the index
+    exists search() returns None and callers keep the LIKE search.
+    """
+
+    def __init__(self):
+        self._ready = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    @property
+    def table(self):
+        return f'{Item._meta.db_table}_fts'
+
+    def build(self, using='default'):
+        """
+        Creates the index, or whatever part of it is missing. Returns False
+        when the database has no full-text support.
+        """
+        connection = connections[using]
+        setup = getattr(self, f'_build_{connection.vendor}', None)
+        with self._lock:
+            try:
+                with transaction.atomic(using=using), connection.cursor() as cursor:
+                    self._ready[using] = bool(setup and setup(cursor))
+            except Exception as e:
+                logger.error(f"Could not build the item search index, searches use LIKE: {e}")
+                self._ready[using] = False
+            self._checked_at[using] = time.monotonic()
+        return self._ready[using]
+
+    def available(self, using='default'):
+        """
+        Whether the index exists, looked up without changing the schema. A
+        missing index is looked for again every RECHECK_INTERVAL seconds.
+        """
+        checked_at = self._checked_at.get(using)
+        if self._ready.get(using) or (checked_at is not None and time.monotonic() - checked_at < RECHECK_INTERVAL):
+            return self._ready[using]
+        with self._lock:
+            connection = connections[using]
+            check = getattr(self, f'_exists_{connection.vendor}', None)
+            try:
+                with connection.cursor() as cursor:
+                    self._ready[using] = bool(check and check(cursor))
+            except Exception as e:
+                logger.error(f"Could not look up the item search index, searches use LIKE: {e}")
+                self._ready[using] = False
+            self._checked_at[using] = time.monotonic()
+        return self._ready[using]
+
+    def search(self, queryset, terms, ranked=False):
+        """
+        Narrows queryset to the items that contain every word of the terms,
+        each word also matching the longer words it is a prefix of. The items
+        are annotated with search_rank, lower is better, and ordered by it
+        when ranked is set. Returns None when the database has no full-text
+        index.
+        """
+        words = [word for term in terms for word in WORD.findall(term)]
+        if not self.available(queryset.db):
+            return None
+        if not words:
+            return queryset.none()
+        vendor = connections[queryset.db].vendor
+        item_table, pk, fts = Item._meta.db_table, Item._meta.pk.column, self.table
+
+        if vendor == 'sqlite':
+            query = ' '.join(f'"{word}"*' for word in words)
+            matches = RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', [query])
+            # bm25 is only computed inside the MATCH query. Materialized, the
+            # matches are ranked once instead of once per item row.
+            rank = RawSQL(f'WITH ranked AS MATERIALIZED (SELECT rowid, rank FROM {fts} WHERE {fts} MATCH %s) '
+                          f'SELECT rank FROM ranked WHERE ranked.rowid = {item_table}.{pk}',
+                          [query], output_field=FloatField())
+            results = queryset.filter(pk__in=matches).annotate(search_rank=rank)
+        else:
+            query = ' & '.join(f'{word}:*' for word in words)
+            matches = RawSQL(f"{item_table}.search_vector @@ to_tsquery('simple', %s)", [query],
+                             output_field=BooleanField())
+            rank = RawSQL(f"-ts_rank('{{0.1, 0.2, {1 / NAME_WEIGHT}, 1.0}}', "
+                          f"{item_table}.search_vector, to_tsquery('simple', %s))", [query],
+                          output_field=FloatField())
+            results = queryset.filter(matches).annotate(search_rank=rank)
+        return results.order_by('search_rank', 'pk') if ranked else results
+
+    def _exists_sqlite(self, cursor):
+        if cursor.db.Database.sqlite_version_info < (3, 35):
+            return False  # The ranked search needs MATERIALIZED
+        fts = self.table
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE name IN (%s, %s, %s, %s)",
+                       [fts, f'{fts}_insert', f'{fts}_delete', f'{fts}_update'])
+        return cursor.fetchone()[0] == 4
+
+    def _build_sqlite(self, cursor):
+        if cursor.db.Database.sqlite_version_info < (3, 35):
+            return False
+        item_table, pk, fts = Item._meta.db_table, Item._meta.pk.column, self.table
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [fts])
+        exists = cursor.fetchone() is not None
+        if not exists:
+            # prefix='2 3' keeps short prefixes, typed first, to a single index lookup
+            cursor.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5("
+                           f"name, description, content='{item_table}', content_rowid='{pk}', "
+                           f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+            cursor.execute(f"INSERT INTO {fts}({fts}, rank) VALUES ('rank', 'bm25({NAME_WEIGHT}, 1.0)')")
+
+        # Triggers go with the table when a migration rebuilds it, so they are re-created every time
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {item_table} BEGIN "
+                       f"INSERT INTO {fts}(rowid, name, description) VALUES (new.{pk}, new.name, new.description); "
+                       f"END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {item_table} BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, name, description) "
+                       f"VALUES ('delete', old.{pk}, old.name, old.description); "
+                       f"END")
+        # save() writes every column, only re-index when the text changed
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF name, description "
+                       f"ON {item_table} WHEN old.name IS NOT new.name OR old.description IS NOT new.description "
+                       f"BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, name, description) "
+                       f"VALUES ('delete', old.{pk}, old.name, old.description); "
+                       f"INSERT INTO {fts}(rowid, name, description) VALUES (new.{pk}, new.name, new.description); "
+                       f"END")
+
+        if not exists:
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            logger.info("Built the item search index")
+        return True
+
+    def _exists_postgresql(self, cursor):
+        item_table = Item._meta.db_table
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s",
+                       [item_table, f'{item_table}_search_vector'])
+        return cursor.fetchone() is not None
+
+    def _build_postgresql(self, cursor):
+        item_table = Item._meta.db_table
+        # 'simple' does no stemming, so prefixes match the words as typed
+        cursor.execute(f"ALTER TABLE {item_table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                       f"GENERATED ALWAYS AS ("
+                       f"setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+                       f"setweight(to_tsvector('simple', coalesce(description, '')), 'B')) STORED")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {item_table}_search_vector "
+                       f"ON {item_table} USING GIN (search_vector)")
+        return True
+
+
+item_search = ItemSearchIndex()
+
+
+class ItemSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter backed by the item full-text index. Results are ranked by
+    relevance unless the request asks for an ordering. Databases without a
+    full-text index use the LIKE search over the view's search_fields.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        ranked = not request.query_params.get(api_settings.ORDERING_PARAM)
+        results = item_search.search(queryset, terms, ranked=ranked)
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+        return results
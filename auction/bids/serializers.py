@@ -1,13 +1,31 @@
 from django.utils import timezone
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 from authentication.models import UserProfile
 from bids.models import (Bid, Bidder, Location, Item, Seller, Category,
-                         SellerRating, BidderRating, WinningPair, Message, ItemImage)
+                         SellerRating, BidderRating, WinningPair, Message, ItemImage, ProxyBid)
 from authentication.serializers import (UserSerializer)
 from django_countries.fields import CountryField
 from django_countries import countries
 from django.conf import settings
 
+class EagerLoadingMixin:
+    """
+    Declares the relations a serializer reads for every instance, so views
+    load them together with the queryset instead of with one query per row.
+    """
+    select_related_fields = []
+    prefetch_related_fields = []
+
+    @classmethod
+    def eager_loading(cls, queryset):
+        return queryset.select_related(*cls.select_related_fields).prefetch_related(*cls.prefetch_related_fields)
+
+    @classmethod
+    def prefetch(cls, instances):
+        """Prefetches the many-valued relations of instances that were already loaded."""
+        prefetch_related_objects(instances, *cls.prefetch_related_fields)
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
@@ -133,13 +151,28 @@ class CreateBidSerializer(serializers.ModelSerializer):
             'amount',
         ]
 
+class ProxyBidSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ProxyBid
+        fields = [
+            'id',
+            'item',
+            'bidder',
+            'max_amount',
+            'max_set_at',
+            'created_at',
+            'updated_at',
+        ]
+        read_only_fields = ['id', 'bidder', 'max_set_at', 'created_at', 'updated_at']
+
 class ItemImageSerializer(serializers.ModelSerializer):
     class Meta():
         model = ItemImage
         fields = ['id', 'image', 'alt_text', 'order', 'uploaded_at']
         read_only_fields = ['id', 'uploaded_at']
 
-class ItemListSerializer(serializers.ModelSerializer):
+class ItemListSerializer(EagerLoadingMixin, serializers.ModelSerializer):
    
     main_image_url = serializers.SerializerMethodField()
 
@@ -167,6 +200,10 @@ class ItemListSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = fields
 
+    # SellerSerializer reads the seller's user, profile and bidder profile
+    select_related_fields = ['seller__userID__profile', 'seller__userID__bidder_id', 'location']
+    prefetch_related_fields = ['categories']
+
     def get_main_image_url(self, obj):
         request = self.context.get('request')
         if not request:
@@ -190,8 +227,11 @@ class ItemDetailSerializer(ItemListSerializer):
             'number_of_bids',
             'additional_images',
             'started',
+            'leading_bidder',
         ]
 
+    prefetch_related_fields = ItemListSerializer.prefetch_related_fields + ['additional_images']
+
 class ItemCreateSerializer(serializers.ModelSerializer):
     country = CountryField()
     publish_immediately = serializers.BooleanField(write_only=True, default=False)
@@ -351,6 +391,11 @@ class OwnerItemDetailSerializer(ItemDetailSerializer):
             'bids',
         ]
 
+    prefetch_related_fields = ItemDetailSerializer.prefetch_related_fields + [
+        # In the order they were placed, whatever index the database reads them through
+        Prefetch('bids', queryset=Bid.objects.select_related('bidder__userID').order_by('time', 'pk')),
+    ]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if (self.instance and self.instance.status == 'active'
@@ -482,7 +527,7 @@ class OwnerItemUpdateSerializer(serializers.ModelSerializer):
     #         raise serializers.ValidationError("Item location must have latitude and longitude.")
     #     return value
 
-class AdminItemSerializer(serializers.ModelSerializer):
+class AdminItemSerializer(EagerLoadingMixin, serializers.ModelSerializer):
 
     additional_images = ItemImageSerializer(many=True, read_only=True)
 
@@ -490,6 +535,8 @@ class AdminItemSerializer(serializers.ModelSerializer):
         model = Item
         fields = '__all__'
 
+    prefetch_related_fields = ['categories', 'additional_images']
+
 
 class SellerRatingSerializer(serializers.ModelSerializer):
     class Meta:
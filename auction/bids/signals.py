@@ -1,6 +1,13 @@
-from django.db.models.signals import post_save
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
-from bids.models import SellerRating, BidderRating
+from bids.models import SellerRating, BidderRating, Item, Bid, Visited
+from bids.bidbook import bid_book
+from bids.scheduler import scheduler
+from bids.training import recommendations_updated
+from bids.vectors import vector_store
+from bids.online import online_updater
+from bids.search import item_search
 
 @receiver(post_save, sender=SellerRating)
 def update_seller_rating_on_create(sender, instance: SellerRating, created, **kwargs):
@@ -18,3 +25,41 @@ def update_bidder_rating_on_create(sender, instance: BidderRating, created, **kw
         winning_pair = instance.winning_pair
         seller = winning_pair.winning_bidder
         seller.add_rating(instance.rating)
+
+@receiver(post_save, sender=Item)
+def refresh_bid_book_on_item_save(sender, instance: Item, created, **kwargs):
+    if bid_book.enabled and not created:
+        bid_book.refresh(instance)
+
+@receiver(post_save, sender=Item)
+def schedule_item_deadline_on_save(sender, instance: Item, **kwargs):
+    # The leader may be another process, which only sees the change once it is committed
+    transaction.on_commit(lambda: scheduler.schedule_item(instance))
+
+@receiver(post_save, sender=Item)
+def update_candidates_on_item_save(sender, instance: Item, **kwargs):
+    # Publishing, closing and cancelling single items all save the status
+    active = instance.status == 'active'
+    transaction.on_commit(lambda: vector_store.set_items_active([instance.pk], active))
+
+@receiver(post_delete, sender=Item)
+def update_candidates_on_item_delete(sender, instance: Item, **kwargs):
+    transaction.on_commit(lambda: vector_store.set_items_active([instance.pk], False))
+
+@receiver(post_migrate)
+def build_search_index_after_migrate(sender, using='default', **kwargs):
+    # Rebuilding the item table drops the search triggers, so put them back
+    if sender.label == 'bids' and Item._meta.db_table in connections[using].introspection.table_names():
+        item_search.build(using)
+
+@receiver(recommendations_updated)
+def reload_vectors_on_training(sender, **kwargs):
+    # Other processes notice the new manifest on their next check
+    vector_store.reload()
+
+@receiver(post_save, sender=Bid)
+@receiver(post_save, sender=Visited)
+def update_vectors_on_interaction(sender, instance, created, **kwargs):
+    if created:
+        # The updater counts the pair's bids and visits, so wait until this one is visible
+        transaction.on_commit(lambda: online_updater.record(instance.bidder_id, instance.item_id))
@@ -1,3 +1,804 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from datetime import timedelta
+from decimal import Decimal
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from authentication.models import UserProfile
+from bids.bidbook import BidBook
+from bids.bidding import BidRejected, ItemNotFound, place_bid, register_proxy_bid
+from bids.lifecycle import close_ended_items
+from bids.listing import ItemListRows
+from bids.models import Bid, Bidder, Category, Item, Location, ProxyBid, Seller, WinningPair
+from bids.online import OnlineUpdater
+from bids.pagination import KeysetPagination
+from bids.recommender import build_ivf, coalesce, init_factors, rmse, search_ivf, sgd_epoch, top_n
+from bids.scheduler import CLOSE, PUBLISH, BackgroundScheduler
+from bids.search import ItemSearchIndex, item_search
+from bids.serializers import ItemListSerializer
+from bids.vectors import Candidates, VectorStore
+from bids.views import ItemViewSet, SellerViewSet
 
-# Create your tests here.
+
+class QueryBudgetMixin:
+    """
+    Fails a test when a request runs more queries than its viewset declares
+    in query_budgets for the action. The failure lists the queries that ran.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, viewset, action):
+        budget = viewset.query_budgets[action]
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertLessEqual(
+            len(context), budget,
+            f"{viewset.__name__}.{action} ran {len(context)} queries, its budget is {budget}:\n{queries}")
+
+
+def create_user(username, seller=False):
+    user = User.objects.create_user(username, password='password')
+    UserProfile.objects.create(user=user, country='GR', bio=f'{username} bio')
+    Bidder.objects.create(userID=user, location=Location.objects.get_or_create(address='Athens')[0], country='GR')
+    if seller:
+        Seller.objects.create(userID=user)
+    return user
+
+
+def create_item(seller, **fields):
+    now = timezone.now()
+    values = {
+        'name': 'Item', 'description': 'An item', 'current_bid': 10, 'first_bid': 10, 'buy_price': None,
+        'country': 'GR', 'location': Location.objects.get_or_create(address='Street')[0],
+        'started': now, 'ends': now + timedelta(days=1), 'seller': seller.seller_id, 'status': 'active',
+    }
+    values.update(fields)
+    return Item.objects.create(**values)
+
+
+def create_vector_store(test):
+    """A VectorStore in a temporary directory that is removed after the test."""
+    store = VectorStore()
+    store.config['VECTORS_DIR'] = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, store.config['VECTORS_DIR'])
+    return store
+
+
+def create_bid_book(test):
+    """A started BidBook logging to a temporary directory, without a flusher thread: tests flush it."""
+    book = BidBook()
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory)
+    book.config.update(LOG_PATH=os.path.join(directory, 'bidbook.log'), FSYNC=False)
+    book.is_running = True
+    book.rebuild()
+    test.addCleanup(lambda: book._log.close())
+    return book
+
+
+def create_items(seller, count, categories):
+    now = timezone.now()
+    for i in range(count):
+        item = create_item(
+            seller, name=f'Item {i}', buy_price=100,
+            location=Location.objects.get_or_create(address=f'Street {i}')[0],
+            ends=now + timedelta(days=1, minutes=i),
+        )
+        item.categories.set(categories)
+
+
+class PlaceBidTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user('seller', seller=True)
+        cls.bidder = create_user('bidder').bidder_id
+        cls.other_bidder = create_user('other_bidder').bidder_id
+
+    def test_accepts_higher_bid(self):
+        item = create_item(self.seller)
+        bid = place_bid(item.pk, self.bidder, '12.50')
+        item.refresh_from_db()
+        self.assertEqual(bid.amount, Decimal('12.50'))
+        self.assertEqual((item.current_bid, item.number_of_bids), (Decimal('12.50'), 1))
+        self.assertEqual((item.leading_bid, item.leading_bidder), (bid, self.bidder))
+
+    def test_rejects_lower_or_equal_bid(self):
+        item = create_item(self.seller)
+        place_bid(item.pk, self.bidder, 20)
+        for amount in (20, '19.99'):
+            with self.subTest(amount=amount), self.assertRaisesMessage(BidRejected, 'greater than the current bid'):
+                place_bid(item.pk, self.other_bidder, amount)
+        item.refresh_from_db()
+        self.assertEqual((item.current_bid, item.number_of_bids, item.leading_bidder), (20, 1, self.bidder))
+
+    def test_rejects_closed_item(self):
+        item = create_item(self.seller, status='sold')
+        with self.assertRaisesMessage(BidRejected, 'not active'):
+            place_bid(item.pk, self.bidder, 20)
+        self.assertFalse(item.bids.exists())
+
+    def test_rejects_ended_item(self):
+        item = create_item(self.seller, ends=timezone.now() - timedelta(minutes=1))
+        with self.assertRaisesMessage(BidRejected, 'Auction has ended'):
+            place_bid(item.pk, self.bidder, 20)
+        item.refresh_from_db()
+        self.assertEqual(item.status, 'expired')
+
+    def test_caps_bid_at_buy_price(self):
+        item = create_item(self.seller, buy_price=150)
+        bid = place_bid(item.pk, self.bidder, 500)
+        item.refresh_from_db()
+        self.assertEqual(bid.amount, 150)
+        self.assertEqual((item.current_bid, item.status), (150, 'sold'))
+        self.assertEqual(item.winning_pair.winning_bid, bid)
+        with self.assertRaises(BidRejected):
+            place_bid(item.pk, self.other_bidder, 600)
+
+    def test_close_when_already_paired(self):
+        item = create_item(self.seller)
+        bid = place_bid(item.pk, self.bidder, 20)
+        WinningPair.objects.create(item=item, winning_bid=bid, winning_bidder=self.bidder)
+        item.refresh_from_db()
+        with transaction.atomic():
+            self.assertFalse(item.close())
+            # The failed insert must not break the enclosing transaction
+            self.assertEqual(Item.objects.get(pk=item.pk).status, 'sold')
+
+    def test_unknown_item(self):
+        for item_id in (0, 'abc', None):
+            with self.subTest(item_id=item_id), self.assertRaises(ItemNotFound):
+                place_bid(item_id, self.bidder, 20)
+
+    def test_api_unknown_item(self):
+        client = APIClient()
+        client.force_authenticate(self.bidder.userID)
+        response = client.post(reverse('bid-list'), {'item': 'abc', 'amount': 20})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProxyBidTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user('seller', seller=True)
+        cls.bidders = [create_user(f'bidder{i}').bidder_id for i in range(3)]
+
+    def assertLeads(self, item, bidder, amount):
+        item.refresh_from_db()
+        self.assertEqual((item.leading_bidder, item.current_bid), (bidder, Decimal(amount)))
+        self.assertEqual(item.leading_bid.amount, Decimal(amount))
+
+    def test_outbids_by_one_increment(self):
+        a, b, _ = self.bidders
+        item = create_item(self.seller, current_bid=100)
+        register_proxy_bid(item.pk, a, 300)
+        self.assertLeads(item, a, '101.00')
+        place_bid(item.pk, b, 150)
+        self.assertLeads(item, a, '151.00')
+        self.assertEqual(list(item.bids.order_by('time', 'pk').values_list('amount', flat=True)),
+                         [Decimal('101.00'), Decimal('150.00'), Decimal('151.00')])
+
+    def test_capped_at_proxy_maximum(self):
+        a, b, _ = self.bidders
+        item = create_item(self.seller, current_bid=100)
+        register_proxy_bid(item.pk, a, '250.50')
+        place_bid(item.pk, b, 250)
+        self.assertLeads(item, a, '250.50')
+        place_bid(item.pk, b, 251)
+        self.assertLeads(item, b, '251.00')
+
+    def test_competing_proxies(self):
+        a, b, _ = self.bidders
+        item = create_item(self.seller, current_bid=120)
+        register_proxy_bid(item.pk, a, 300)
+        register_proxy_bid(item.pk, b, 400)
+        self.assertLeads(item, b, '301.00')
+
+    def test_equal_maximums_go_to_the_first(self):
+        a, b, c = self.bidders
+        item = create_item(self.seller, current_bid=100)
+        register_proxy_bid(item.pk, a, 300)
+        register_proxy_bid(item.pk, b, 300)
+        self.assertLeads(item, a, '300.00')
+        with self.assertRaises(BidRejected):
+            register_proxy_bid(item.pk, c, 300)
+
+    def test_registering_the_same_maximum_keeps_priority(self):
+        a, b, _ = self.bidders
+        item = create_item(self.seller, current_bid=100)
+        ProxyBid.objects.create(item=item, bidder=a, max_amount=300)
+        ProxyBid.objects.create(item=item, bidder=b, max_amount=300)
+        register_proxy_bid(item.pk, a, 300)
+        self.assertLeads(item, a, '300.00')
+
+    def test_capped_at_buy_price(self):
+        a, b, _ = self.bidders
+        item = create_item(self.seller, current_bid=100, buy_price=250)
+        register_proxy_bid(item.pk, a, 300)
+        register_proxy_bid(item.pk, b, 280)
+        self.assertLeads(item, a, '250.00')
+        self.assertEqual(item.status, 'sold')
+        self.assertEqual(item.winning_pair.winning_bidder, a)
+
+    def test_leader_without_proxy_holds_below_maximum(self):
+        a, b, _ = self.bidders
+        item = create_item(self.seller, current_bid=100)
+        place_bid(item.pk, a, 200)
+        with self.assertRaises(BidRejected):
+            register_proxy_bid(item.pk, b, 200)
+        register_proxy_bid(item.pk, b, '200.50')
+        self.assertLeads(item, b, '200.50')
+
+
+@mock.patch('bids.bidbook.online_updater')
+class BidBookTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user('seller', seller=True)
+        cls.bidders = [create_user(f'bidder{i}').bidder_id for i in range(2)]
+
+    def setUp(self):
+        self.item = create_item(self.seller, buy_price=100)
+        self.book = create_bid_book(self)
+
+    def test_accepts_and_rejects_in_memory(self, online_updater):
+        a, b = self.bidders
+        with self.assertNumQueries(0):
+            bid = self.book.place(self.item.pk, a, 20)
+            for amount in (20, 15):
+                with self.subTest(amount=amount), self.assertRaises(BidRejected):
+                    self.book.place(self.item.pk, b, amount)
+        self.assertEqual((bid.pk, bid.amount), (None, 20))
+        self.assertEqual(self.book.top_bids(self.item.pk), [(20, a.pk)])
+        self.assertFalse(Bid.objects.exists())
+        with self.assertRaises(ItemNotFound):
+            self.book.place('abc', a, 20)
+
+    def test_flush_keeps_the_accepted_times(self, online_updater):
+        a, b = self.bidders
+        first = self.book.place(self.item.pk, a, 20)
+        second = self.book.place(self.item.pk, b, 30)
+        self.assertEqual(self.book.flush(), 2)
+
+        bids = list(self.item.bids.order_by('pk'))
+        self.assertEqual([(bid.bidder, bid.amount, bid.time) for bid in bids],
+                         [(a, 20, first.time), (b, 30, second.time)])
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.current_bid, self.item.number_of_bids, self.item.leading_bid),
+                         (30, 2, bids[1]))
+        online_updater.record.assert_has_calls([mock.call(a.pk, self.item.pk), mock.call(b.pk, self.item.pk)])
+        self.assertEqual(self.book.flush(), 0)
+
+    def test_buy_price_closes_the_item_on_flush(self, online_updater):
+        a, b = self.bidders
+        bid = self.book.place(self.item.pk, a, 150)
+        self.assertEqual(bid.amount, 100)
+        with self.assertRaisesMessage(BidRejected, 'not active'):
+            self.book.place(self.item.pk, b, 200)
+        self.book.flush()
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.status, self.item.winning_pair.winning_bidder), ('sold', a))
+
+    def test_replays_unflushed_bids(self, online_updater):
+        self.book.place(self.item.pk, self.bidders[0], 20)
+        self.book._log.close()
+        book = BidBook()
+        book.config.update(self.book.config)
+        book.is_running = True
+        book.rebuild()
+        self.addCleanup(lambda: book._log.close())
+        self.assertEqual(book.flush(), 1)
+        self.assertEqual(self.item.bids.get().amount, 20)
+
+    def test_api_accepts_unwritten_bids(self, online_updater):
+        self.book.enabled = True
+        client = APIClient()
+        client.force_authenticate(self.bidders[0].userID)
+        with mock.patch('bids.views.bid_book', self.book):
+            response = client.post(reverse('bid-list'), {'item': self.item.pk, 'amount': 20})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.book.top_bids(self.item.pk), [(20, self.bidders[0].pk)])
+
+    def test_hand_over(self, online_updater):
+        a, b = self.bidders
+        self.book.place(self.item.pk, a, 20)
+        self.book.hand_over(self.item.pk)
+        # Bids accepted in memory are written before the database engine takes the item over
+        self.assertEqual(self.item.bids.get().amount, 20)
+        bid = self.book.place(self.item.pk, b, 30)
+        self.assertIsNotNone(bid.pk)
+        self.assertEqual(self.book.top_bids(self.item.pk), [])
+
+        # Items closed here or in another process leave the handed-over set
+        item = Item.objects.get(pk=self.item.pk)
+        item.close()
+        self.book.refresh(item)
+        self.assertNotIn(self.item.pk, self.book._proxied)
+        self.book.hand_over(self.item.pk)
+        Item.objects.filter(pk=self.item.pk).update(status='sold')
+        self.book.place(create_item(self.seller).pk, a, 20)
+        self.assertEqual(self.book.flush(), 1)
+        self.assertNotIn(self.item.pk, self.book._proxied)
+
+
+class CloseEndedItemsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user('seller', seller=True)
+        cls.bidders = [create_user(f'bidder{i}').bidder_id for i in range(2)]
+
+    def ended_item(self, *amounts, **fields):
+        item = create_item(self.seller, **fields)
+        for bidder, amount in zip(self.bidders * len(amounts), amounts):
+            place_bid(item.pk, bidder, amount)
+        Item.objects.filter(pk=item.pk).update(ends=timezone.now() - timedelta(minutes=1))
+        return item
+
+    def test_closes_ended_items(self):
+        unsold, sold = self.ended_item(), self.ended_item(20, 30)
+        open_item = create_item(self.seller)
+        self.assertEqual(sorted(close_ended_items(batch_size=1)), sorted([unsold.pk, sold.pk]))
+        statuses = dict(Item.objects.values_list('pk', 'status'))
+        self.assertEqual((statuses[unsold.pk], statuses[sold.pk], statuses[open_item.pk]),
+                         ('expired', 'sold', 'active'))
+        pair = WinningPair.objects.get(item=sold)
+        self.assertEqual((pair.winning_bidder, pair.winning_bid.amount), (self.bidders[1], 30))
+
+    def test_leaves_items_that_closed_meanwhile(self):
+        item = self.ended_item(20)
+        Item.objects.filter(pk=item.pk).update(status='cancelled')
+        self.assertEqual(close_ended_items(), [])
+        self.assertEqual(Item.objects.get(pk=item.pk).status, 'cancelled')
+        self.assertFalse(WinningPair.objects.exists())
+
+
+class SchedulerTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.scheduler = self.create_scheduler()
+        # Only _pop_due, without the scheduler thread
+        self.scheduler.is_running = True
+        self.addCleanup(self.scheduler.stop)
+        self.now = timezone.now()
+
+    def create_scheduler(self):
+        scheduler = BackgroundScheduler()
+        scheduler.config['INBOX_PATH'] = os.path.join(self.directory, 'scheduler.sock')
+        return scheduler
+
+    def test_pops_due_entries_in_deadline_order(self):
+        for item_id, seconds in ((1, -1), (2, -3), (3, 60), (4, -2)):
+            self.scheduler.schedule(self.now + timedelta(seconds=seconds), CLOSE, item_id)
+        self.scheduler.schedule(self.now - timedelta(seconds=5), PUBLISH, 5)
+        due = self.scheduler._pop_due()
+        self.assertEqual((due[CLOSE], due[PUBLISH]), ([2, 4, 1], [5]))
+        self.assertEqual(self.scheduler._heap[0][2:], (CLOSE, 3))
+
+    def test_same_deadline_is_pushed_once(self):
+        seller = create_user('seller', seller=True)
+        item = create_item(seller)
+        self.scheduler.schedule(item.ends, CLOSE, item.pk)
+        self.scheduler.schedule(item.ends, CLOSE, item.pk)
+        self.assertEqual(self.scheduler._load_deadlines(), 0)
+        self.assertEqual(len(self.scheduler._heap), 1)
+
+    def test_rescheduling_keeps_the_new_deadline(self):
+        later = self.now + timedelta(minutes=5)
+        self.scheduler.schedule(self.now - timedelta(seconds=1), CLOSE, 1)
+        self.scheduler.schedule(later, CLOSE, 1)
+        # The stale entry still comes up; the close job finds the item not due
+        self.assertEqual(self.scheduler._pop_due()[CLOSE], [1])
+        self.assertEqual(self.scheduler._scheduled, {(CLOSE, 1): later})
+        self.assertEqual([entry[0] for entry in self.scheduler._heap], [later])
+
+    def test_other_processes_send_near_deadlines_to_the_leader(self):
+        self.scheduler._listen()
+        sender = self.create_scheduler()
+        sender.schedule_item(Item(pk=1, status='active', ends=self.now + timedelta(seconds=30)))
+        sender.schedule_item(Item(pk=2, status='pending', started=self.now + timedelta(seconds=10)))
+        # Loaded by a resync before it is due
+        sender.schedule_item(Item(pk=3, status='active', ends=self.now + timedelta(days=1)))
+        for _ in range(50):
+            if len(self.scheduler._scheduled) == 2:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.scheduler._scheduled, {
+            (CLOSE, 1): self.now + timedelta(seconds=30),
+            (PUBLISH, 2): self.now + timedelta(seconds=10),
+        })
+
+    def test_sending_without_a_leader(self):
+        self.scheduler.is_running = False
+        self.scheduler.schedule_item(Item(pk=1, status='active', ends=self.now))
+        self.assertEqual(self.scheduler._heap, [])
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_user('seller', seller=True)
+        # Nulls and ties on the ordering field, so pages break inside a run of equal values
+        for buy_price in [100, None, 50, 100, None, 200, 50, 100, None, 75, 100]:
+            create_item(seller, buy_price=buy_price)
+
+    def walk(self, queryset, cursor='', link='next'):
+        """Follows the link from page to page, returning the pages' ids and the last page's paginator."""
+        pages = []
+        while cursor is not None:
+            pagination = KeysetPagination()
+            pagination.page_size = 3
+            request = Request(APIRequestFactory().get(reverse('item-list'), {'cursor': cursor}))
+            pages.append([item.pk for item in pagination.paginate_queryset(queryset, request)])
+            url = pagination.get_paginated_response([]).data[link]
+            cursor = parse_qs(urlparse(url).query)['cursor'][0] if url else None
+        return pages, pagination
+
+    def assertWalks(self, ordering, key):
+        expected = [item.pk for item in sorted(Item.objects.all(), key=key)]
+        pages, _ = self.walk(Item.objects.order_by(ordering))
+        self.assertEqual([pk for page in pages for pk in page], expected)
+        self.assertTrue(all(len(page) == 3 for page in pages[:-1]))
+
+    def test_forward_walk_ascending_with_nulls_last(self):
+        self.assertWalks('buy_price', lambda item: (item.buy_price is None, item.buy_price or 0, item.pk))
+
+    def test_forward_walk_descending_with_nulls_last(self):
+        self.assertWalks('-buy_price', lambda item: (item.buy_price is None, -(item.buy_price or 0), -item.pk))
+
+    def test_backward_walk_returns_the_same_pages(self):
+        queryset = Item.objects.order_by('buy_price')
+        forward, last = self.walk(queryset)
+        backward, _ = self.walk(queryset, cursor=last.previous_cursor, link='previous')
+        self.assertEqual(backward, forward[-2::-1])
+
+    def test_page_numbers_without_cursor(self):
+        response = APIClient().get(reverse('item-list'))
+        self.assertEqual(response.data['count'], 11)
+
+    def test_invalid_cursor(self):
+        pagination = KeysetPagination()
+        for cursor in ('garbage', 'W10=', 'WyJ4IiwxLGZhbHNlXQ=='):
+            request = Request(APIRequestFactory().get(reverse('item-list'), {'cursor': cursor}))
+            with self.subTest(cursor=cursor), self.assertRaises(NotFound):
+                pagination.paginate_queryset(Item.objects.order_by('buy_price'), request)
+        response = APIClient().get(reverse('item-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ItemQueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = [Category.objects.create(name='Books'), Category.objects.create(name='Music')]
+        cls.seller = create_user('seller', seller=True)
+        cls.other_seller = create_user('other_seller', seller=True)
+        create_items(cls.seller, 8, cls.categories)
+        create_items(cls.other_seller, 8, cls.categories)
+
+        cls.item = cls.seller.seller_id.items.first()
+        for i in range(6):
+            bidder = create_user(f'bidder{i}')
+            Bid.objects.create(item=cls.item, bidder=bidder.bidder_id, amount=11 + i)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_list(self):
+        with self.assertQueryBudget(ItemViewSet, 'list'):
+            response = self.client.get(reverse('item-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 16)
+        self.assertEqual(response.data['results'][0]['seller']['profile']['bio'], 'seller bio')
+        self.assertEqual(len(response.data['results'][0]['categories']), 2)
+
+    def test_list_queries_do_not_grow_with_the_page(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('item-list'), {'seller': self.seller.seller_id.pk})
+        create_items(self.seller, 20, self.categories)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(reverse('item-list'), {'seller': self.seller.seller_id.pk})
+        self.assertEqual(len(small), len(large))
+
+    def test_list_cursor_page(self):
+        with self.assertQueryBudget(ItemViewSet, 'list'):
+            response = self.client.get(reverse('item-list'), {'cursor': ''})
+        self.assertEqual(len(response.data['results']), 16)
+
+    def test_ending_soon(self):
+        with self.assertQueryBudget(ItemViewSet, 'ending_soon'):
+            response = self.client.get(reverse('item-ending-soon'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve(self):
+        for user in (None, self.seller, self.other_seller):
+            self.client.force_authenticate(user)
+            with self.subTest(user=user), self.assertQueryBudget(ItemViewSet, 'retrieve'):
+                response = self.client.get(reverse('item-detail', args=[self.item.pk]))
+            self.assertEqual(response.status_code, 200)
+
+    def test_retrieve_owner_sees_bids(self):
+        self.client.force_authenticate(self.seller)
+        with self.assertQueryBudget(ItemViewSet, 'retrieve'):
+            response = self.client.get(reverse('item-detail', args=[self.item.pk]))
+        self.assertEqual(len(response.data['bids']), 6)
+        self.assertEqual(response.data['bids'][0]['bidder']['username'], 'bidder0')
+
+    def test_my_items(self):
+        self.client.force_authenticate(self.seller)
+        with self.assertQueryBudget(SellerViewSet, 'my_items'):
+            response = self.client.get(reverse('seller-my-items'))
+        self.assertEqual(response.data['count'], 8)
+
+    def test_budget_failure_lists_queries(self):
+        with self.assertRaisesMessage(AssertionError, 'ItemViewSet.list ran 4 queries, its budget is 3'):
+            with self.assertQueryBudget(ItemViewSet, 'list'):
+                for _ in range(4):
+                    list(Category.objects.all())
+
+
+class ItemListRowsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(name='Books'), Category.objects.create(name='Music')]
+        seller = create_user('seller', seller=True)
+        UserProfile.objects.filter(user=seller).update(profile_image='profile_images/profile 1.jpg')
+        create_items(seller, 3, categories)
+        # A seller without a profile or a bidder profile
+        Seller.objects.create(userID=User.objects.create_user('bare', password='password'))
+        create_items(User.objects.get(username='bare'), 2, categories[:1])
+
+        items = list(Item.objects.order_by('pk'))
+        Item.objects.filter(pk=items[0].pk).update(main_image='')
+        Item.objects.filter(pk=items[1].pk).update(main_image='item_images/chair & table.png', buy_price=None)
+        Item.objects.filter(pk=items[2].pk).update(location=Location.objects.create(
+            address='Patras', latitude=38.2466, longitude=21.7346))
+        items[3].categories.clear()
+
+    def assertSameAsSerializer(self, request):
+        queryset = Item.objects.order_by('ends')
+        context = {'request': Request(request)} if request else {}
+        expected = ItemListSerializer(ItemListSerializer.eager_loading(queryset), many=True, context=context).data
+        rows = ItemListRows(context.get('request')).to_representation(ItemListRows.values(queryset))
+        self.assertEqual(JSONRenderer().render(rows), JSONRenderer().render(expected))
+
+    def test_same_as_serializer(self):
+        self.assertSameAsSerializer(APIRequestFactory().get(reverse('item-list')))
+
+    def test_same_as_serializer_without_request(self):
+        self.assertSameAsSerializer(None)
+
+    def test_queries(self):
+        with self.assertNumQueries(2):
+            ItemListRows().to_representation(ItemListRows.values(Item.objects.all()))
+
+
+class RecommenderTests(SimpleTestCase):
+
+    def test_coalesce_sums_repeated_pairs(self):
+        interactions = coalesce([1, 0, 1, 0], [0, 2, 1, 2], [2.0, 1.0, 4.0, 3.0], (2, 3))
+        self.assertEqual(interactions.shape, (2, 3))
+        np.testing.assert_array_equal(interactions.users, [0, 1, 1])
+        np.testing.assert_array_equal(interactions.items, [2, 0, 1])
+        np.testing.assert_array_equal(interactions.values, [4.0, 2.0, 4.0])
+
+    def test_sgd_epoch_fits_the_interactions(self):
+        rng = np.random.RandomState(0)
+        users, items = np.divmod(rng.choice(40 * 30, 600, replace=False), 30)
+        truth_users, truth_items = rng.uniform(0.5, 1.2, (40, 3)), rng.uniform(0.5, 1.2, (30, 3))
+        values = np.einsum('ij,ij->i', truth_users[users], truth_items[items])
+        # Users without interactions keep their factors
+        user_matrix, item_matrix = init_factors(41, 30, values)
+        idle = user_matrix[40].copy()
+
+        before = rmse(user_matrix, item_matrix, users, items, values)
+        for _ in range(30):
+            sgd_epoch(user_matrix, item_matrix, users, items, values, learning_rate=0.05, batch_size=64, rng=rng)
+        self.assertLess(rmse(user_matrix, item_matrix, users, items, values), before / 2)
+        np.testing.assert_array_equal(user_matrix[40], idle)
+        self.assertTrue((user_matrix >= 0.001).all() and (item_matrix >= 0.001).all())
+
+    def test_top_n_matches_a_full_sort(self):
+        rng = np.random.RandomState(0)
+        user_matrix, item_matrix = rng.rand(7, 4), rng.rand(50, 4)
+        expected = np.argsort(-(user_matrix @ item_matrix.T), axis=1, kind='stable')
+        # Blocks of two users
+        with mock.patch('bids.recommender.TOP_N_BLOCK_CELLS', 100):
+            np.testing.assert_array_equal(top_n(user_matrix, item_matrix, 10), expected[:, :10])
+        np.testing.assert_array_equal(top_n(user_matrix, item_matrix, 5, rows=[6, 2]), expected[[6, 2], :5])
+
+        padded = top_n(user_matrix, item_matrix[:3], 5)
+        np.testing.assert_array_equal(padded[:, :3], np.argsort(-(user_matrix @ item_matrix[:3].T), axis=1))
+        np.testing.assert_array_equal(padded[:, 3:], -1)
+
+    def test_search_ivf_recall(self):
+        rng = np.random.RandomState(0)
+        # Items in clusters, as trained factors are
+        centers = rng.rand(20, 8)
+        item_matrix = centers[rng.randint(20, size=2000)] + rng.normal(0, 0.05, (2000, 8))
+        index = build_ivf(item_matrix, n_lists=20)
+        self.assertEqual(sorted(index.rows), list(range(2000)))
+
+        hits = 0
+        for user_vector in rng.rand(20, 8):
+            exact = np.argsort(-(item_matrix @ user_vector))[:10]
+            hits += len(np.intersect1d(search_ivf(index, item_matrix, user_vector, 10, nprobe=5), exact))
+            # Probing every list is exact
+            np.testing.assert_array_equal(search_ivf(index, item_matrix, user_vector, 10, nprobe=20), exact)
+        self.assertGreaterEqual(hits / 200, 0.9)
+
+
+class VectorStoreTests(TestCase):
+
+    def setUp(self):
+        self.store = create_vector_store(self)
+        self.item_ids = np.array([3, 5, 8])
+        self.version = self.store.publish(
+            np.ones((2, 3)), np.ones((3, 3)), user_ids=[1, 2],
+            candidates=Candidates(self.item_ids, np.ones(3, dtype=bool), np.zeros(3, dtype=np.int64)))
+
+    def test_publish_and_reload(self):
+        # Another process serving the same directory
+        reader = VectorStore()
+        reader.config = self.store.config
+        vectors = reader.current()
+        self.assertEqual(vectors.version, self.version)
+        self.assertEqual(vectors.users.shape, (2 + self.store.config['SPARE_USER_ROWS'], 3))
+        self.assertEqual([reader.user_row(vectors, user_id) for user_id in (1, 2, 7)], [0, 1, None])
+        self.assertEqual([reader.item_row(vectors, item_id) for item_id in (5, 4)], [1, None])
+        self.assertIsNone(vectors.top_items)
+
+        items = np.arange(12.0).reshape(4, 3)
+        top_items = np.array([[3, 2], [1, -1]])
+        ann = build_ivf(items, n_lists=2)
+        self.store.config['KEEP_VERSIONS'] = 1
+        version = self.store.publish(np.full((2, 3), 2.0), items, top_items, 123.0, ann, user_ids=[4, 6])
+        reader.reload()
+        new = reader.current()
+        self.assertEqual(new.version, version)
+        np.testing.assert_array_equal(new.items, items)
+        np.testing.assert_array_equal(new.top_items, top_items)
+        for name in ann._fields:
+            np.testing.assert_array_equal(getattr(new.ann, name), getattr(ann, name))
+        self.assertEqual(new.manifest['lists_updated_at'], 123.0)
+        self.assertEqual(reader.user_row(new, 6), 1)
+        # The replaced version is removed, and still readable where it is mapped
+        self.assertFalse(os.path.exists(os.path.join(self.store.directory, 'versions', str(self.version))))
+        np.testing.assert_array_equal(vectors.items, 1.0)
+
+    def test_sync_items_active(self):
+        # Item 5 closed and item 9 was published while the version was written
+        self.assertTrue(self.store.sync_items_active(self.version, lambda: [3, 8, 9]))
+        np.testing.assert_array_equal(self.store.current().candidates.active, [True, False, True])
+        self.store.publish(np.ones((2, 3)), np.ones((3, 3)))
+        self.assertFalse(self.store.sync_items_active(self.version, lambda: []))
+
+    def test_status_change_during_sync_is_kept(self):
+        # Another process closes item 3 after the sync read the active items
+        other = VectorStore()
+        other.config = self.store.config
+        closing = threading.Thread(target=other.set_items_active, args=([3], False))
+
+        def active_ids():
+            closing.start()
+            closing.join(0.2)
+            self.assertTrue(closing.is_alive())
+            return [3, 5, 8]
+
+        self.store.sync_items_active(self.version, active_ids)
+        closing.join()
+        self.store.reload()
+        np.testing.assert_array_equal(self.store.current().candidates.active, [False, True, True])
+
+
+class OnlineUpdateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_user('seller', seller=True)
+        cls.users = [create_user(f'bidder{i}') for i in range(3)]
+        cls.items = [create_item(seller) for _ in range(3)]
+
+    def setUp(self):
+        # A model trained on the first two users and items
+        self.store = create_vector_store(self)
+        self.store.config['SPARE_USER_ROWS'] = 1
+        item_ids = np.array([item.pk for item in self.items[:2]])
+        self.store.publish(np.full((2, 3), 0.5), np.ones((2, 3)), user_ids=[user.pk for user in self.users[:2]],
+                           candidates=Candidates(item_ids, np.ones(2, dtype=bool), np.zeros(2, dtype=np.int64)))
+        self.updater = OnlineUpdater(self.store)
+
+    def bid(self, user, item):
+        Bid.objects.create(item=item, bidder=user.bidder_id, amount=20)
+        return user.bidder_id.pk, item.pk
+
+    def test_updates_the_served_version_while_a_training_run_reassigns_indexes(self):
+        # A new training run has started and swapped the users' database indexes
+        UserProfile.objects.filter(user=self.users[0]).update(index=1)
+        UserProfile.objects.filter(user=self.users[1]).update(index=0)
+        self.assertEqual(self.updater.apply([self.bid(self.users[0], self.items[1])]), 1)
+        users = self.store.current().users
+        self.assertTrue((users[0] > 0.5).all())
+        np.testing.assert_array_equal(users[1], 0.5)
+
+    def test_user_without_a_row_gets_a_spare_one(self):
+        vectors = self.store.current()
+        self.assertIsNone(self.store.user_row(vectors, self.users[2].pk))
+        self.assertEqual(self.updater.apply([self.bid(self.users[2], self.items[0])]), 1)
+        self.assertEqual(self.store.user_row(vectors, self.users[2].pk), 2)
+        self.assertEqual(self.updater.apply([self.bid(self.users[2], self.items[1])]), 1)
+        self.assertEqual(self.store.user_row(vectors, self.users[2].pk), 2)
+        self.assertTrue((vectors.users[2] > 0.5).all())
+
+    def test_spare_rows_run_out(self):
+        other = create_user('late')
+        self.updater.apply([self.bid(self.users[2], self.items[0])])
+        self.assertEqual(self.updater.apply([self.bid(other, self.items[0])]), 0)
+        self.assertIsNone(self.store.user_row(self.store.current(), other.pk))
+
+    def test_item_created_after_training_is_skipped(self):
+        self.assertEqual(self.updater.apply([self.bid(self.users[0], self.items[2])]), 0)
+        np.testing.assert_array_equal(self.store.current().users[0], 0.5)
+
+
+class ItemSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_user('seller', seller=True)
+        cls.lamp = create_item(seller, name='Brass lamp', description='A desk lamp')
+        cls.table = create_item(seller, name='Oak table', description='Comes with a brass lamp')
+        cls.chair = create_item(seller, name='Chair', description='Lampshade not included')
+
+    def search(self, *terms, ranked=True):
+        return [item.pk for item in item_search.search(Item.objects.all(), terms, ranked=ranked)]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search('brass lamp'), [self.lamp.pk, self.table.pk])
+
+    def test_words_match_as_prefixes(self):
+        results = self.search('lamp')
+        self.assertEqual((results[0], sorted(results[1:])), (self.lamp.pk, [self.table.pk, self.chair.pk]))
+        self.assertEqual(self.search('oa'), [self.table.pk])
+        self.assertEqual(self.search('oak', 'chair'), [])
+
+    def test_index_follows_edits(self):
+        Item.objects.filter(pk=self.chair.pk).update(name='Brass chair')
+        self.assertEqual(sorted(self.search('brass', ranked=False)), [self.lamp.pk, self.table.pk, self.chair.pk])
+        self.chair.delete()
+        self.assertEqual(self.search('chair'), [])
+
+    def test_api_search(self):
+        response = APIClient().get(reverse('item-list'), {'search': 'brass'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.lamp.pk, self.table.pk])
+
+    def test_falls_back_to_like_without_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {item_search.table}_update')
+        self.assertIsNone(ItemSearchIndex().search(Item.objects.all(), ['lamp']))
+        with mock.patch.dict(item_search._ready, {'default': False}), \
+                mock.patch.dict(item_search._checked_at, {'default': float('-inf')}):
+            response = APIClient().get(reverse('item-list'), {'search': 'lamp'})
+        self.assertEqual({item['id'] for item in response.data['results']}, {self.lamp.pk, self.table.pk, self.chair.pk})
@@ -0,0 +1,56 @@
+import logging
+import os
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+# Set in the environment of the training process so it skips the scheduler and bid book
+WORKER_ENV = 'BIDS_TRAINING_WORKER'
+
+# Sent in the process that launched training once new latent vectors are saved
+recommendations_updated = Signal()
+
+
+def run_training(niceness=10, memory_limit_mb=None, timeout=None, refresh_lists=False, workers=1):
+    """
+    Runs the generate_recommendations command in a separate Python process,
+    so the CPU-bound training loop does not hold the GIL of the web process.
+    The child lowers its own priority and caps its address space before it
+    starts training, which runs in workers processes. With refresh_lists it
+    skips training and only refreshes the top-N lists of recently active users.
+
+    Returns True and sends recommendations_updated when training succeeded.
+    """
+    command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'),
+               'generate_recommendations', '--niceness', str(niceness)]
+    if memory_limit_mb:
+        command += ['--memory-limit', str(memory_limit_mb)]
+    if workers > 1:
+        command += ['--workers', str(workers)]
+    if refresh_lists:
+        command.append('--refresh-lists')
+
+    env = {**os.environ, WORKER_ENV: '1'}
+    env.pop('RUN_MAIN', None)
+
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, timeout=timeout,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except subprocess.TimeoutExpired:
+        logger.error(f"Recommendation training killed after {timeout} seconds")
+        return False
+
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        tail = '\n'.join(result.stdout.splitlines()[-20:])
+        logger.error(f"Recommendation training failed with exit code {result.returncode}:\n{tail}")
+        return False
+
+    logger.info(f"Recommendation {'list refresh' if refresh_lists else 'training'} finished in {elapsed:.1f} s")
+    recommendations_updated.send(sender=run_training)
+    return True
@@ -4,13 +4,15 @@ from rest_framework_nested import routers
 from .views import (
     ItemViewSet, BidViewSet, BidderViewSet, SellerViewSet,
     CategoryViewSet, SellerRatingsViewSet, BidderRatingsViewSet,
-    WinningPairViewSet, ItemImageViewSet, MessageViewset
+    WinningPairViewSet, ItemImageViewSet, MessageViewset, ProxyBidViewSet,
+    SchedulerMetricsViewSet
 )
 
 router = DefaultRouter()
 
 router.register(r'items', ItemViewSet, basename='item')
 router.register(r'bids', BidViewSet, basename='bid')
+router.register(r'proxy-bids', ProxyBidViewSet, basename='proxy-bid')
 router.register(r'bidders', BidderViewSet, basename='bidder')
 router.register(r'sellers', SellerViewSet, basename='seller')
 router.register(r'categories', CategoryViewSet, basename='category')
@@ -18,6 +20,7 @@ router.register(r'seller-ratings', SellerRatingsViewSet, basename='seller-rating
 router.register(r'bidder-ratings', BidderRatingsViewSet, basename='bidder-rating')
 router.register(r'winning-pairs', WinningPairViewSet, basename='winning-pair')
 router.register(r'messages', MessageViewset, basename='message')
+router.register(r'scheduler-metrics', SchedulerMetricsViewSet, basename='scheduler-metrics')
 
 items_router = routers.NestedDefaultRouter(router, r'items', lookup='item')
 items_router.register(r'images', ItemImageViewSet, basename='item-images')
@@ -1,34 +1,104 @@
 import numpy as np
 from django.contrib.auth import get_user_model
+from authentication.models import UserProfile
 from bids.models import Item
+from bids.recommender import search_ivf
+from bids.vectors import vector_store
 from django.utils import timezone
 
-ROOT_PATH = '/home/duck/project_auction/auction_backend/auction/'
-
 User = get_user_model()
 
 
+class RecommendedItems:
+    """
+    Candidate items ranked by predicted rating, highest first. Behaves like a
+    read-only list, so the paginator can count and slice it: a slice only
+    ranks the items up to its end with argpartition and loads just the Item
+    rows inside it. Without scores the item ids are already in rank order.
+    Page rows are loaded from queryset, which views can extend with the
+    relations their serializer reads.
+    """
+
+    def __init__(self, item_ids, scores=None, queryset=None):
+        self.item_ids = item_ids
+        self.scores = scores
+        # Items that closed since the candidate arrays were last written drop out here
+        self.queryset = Item.objects.filter(status='active') if queryset is None else queryset
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def __iter__(self):
+        return iter(self[:len(self)])
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            items = self[key:key + 1] if key >= 0 else self[len(self) + key:len(self) + key + 1]
+            if not items:
+                raise IndexError('Recommendation index out of range')
+            return items[0]
+
+        start, stop, step = key.indices(len(self))
+        if start >= stop:
+            return []
+        if self.scores is None:
+            top = np.arange(stop)
+        else:
+            # Partial ranking: only the top `stop` scores are sorted
+            top = np.argpartition(-self.scores, stop - 1)[:stop] if stop < len(self) else np.arange(len(self))
+            top = top[np.lexsort((top, -self.scores[top]))]
+        page_ids = [int(item_id) for item_id in self.item_ids[top[start:stop:step]]]
+
+        items = self.queryset.in_bulk(page_ids)
+        return [items[item_id] for item_id in page_ids if item_id in items]
+
+
 def generate_recommendations(user, ending_soon=False):
-    # Get user id 
-    user_id = user.id
+    """
+    Reads the user's precomputed top-N list when there is one, dropping items
+    that closed since. Otherwise scores the active items the user does not
+    sell against the current latent vectors: the top-N of the probed IVF
+    lists when the model has an index, else every item with one
+    matrix-vector product. Candidates are filtered with the model's active
+    and seller arrays, so no Item query runs before the page is loaded.
+    Returns RecommendedItems, or None when there is no model yet or the user
+    has no vector (no activity since joining).
+    """
+    # Memory-mapped matrices of the current model, shared with the other requests
+    vectors = vector_store.current()
+    if vectors is None:
+        return None
+    item_vectors, user_vectors = vectors.items, vectors.users
 
-    ratings = []
+    if vectors.user_ids is not None:
+        user_index = vector_store.user_row(vectors, user.id)
+    else:
+        # Versions written before they carried their user ids
+        user_index = UserProfile.objects.filter(user=user).values_list('index', flat=True).first()
+    if user_index is None or user_index >= len(user_vectors):
+        return None
+    candidates = vectors.candidates
+    if candidates is None:
+        return _score_active_items(user, item_vectors, np.asarray(user_vectors[user_index]))
 
-    # Load the metrices
-    item_vectors = np.load(ROOT_PATH + '/data/latent_vectors/items.npy')
-    user_vectors = np.load(ROOT_PATH + '/data/latent_vectors/users.npy')
+    def allowed(rows):
+        return candidates.active[rows] & (candidates.sellers[rows] != user.id)
 
-    user_index = user.profile.index
-    # except (AttributeError, TypeError) as e:
-    #     raise ValueError("User has no recommendation data available yet. Try viewing or bidding on some items first.")
+    if vectors.top_items is not None and user_index < len(vectors.top_items):
+        ranked = np.asarray(vectors.top_items[user_index])
+        ranked = ranked[ranked >= 0]
+        rows = np.minimum(np.searchsorted(candidates.ids, ranked), len(candidates.ids) - 1)
+        return RecommendedItems(ranked[(candidates.ids[rows] == ranked) & allowed(rows)])
 
     # Get user vector
-    user_vector = user_vectors[user.profile.index]
+    user_vector = np.asarray(user_vectors[user_index])
+
+    if vectors.ann is not None:
+        rows = search_ivf(vectors.ann, item_vectors, user_vector,
+                          vector_store.config['TOP_N'], vector_store.config['ANN_NPROBE'])
+        rows = rows[allowed(rows)]
+        return RecommendedItems(np.asarray(candidates.ids[rows]))
 
-    # Get active item indices
-    items = Item.objects.filter(status='active', index__isnull=False
-                        ).exclude(seller__userID=user.id)
-    
     # if ending_soon:
     #     now = timezone.now()
     #     tomorrow = now + timezone.timedelta(days=1)
@@ -37,18 +107,19 @@ def generate_recommendations(user, ending_soon=False):
     #         ends_gte=now,
     #     )
 
-    print(len(items))
-
-    # For each item, calculate rating and append to list
-    for item in items:
-        try:
-            rating = np.dot(item_vectors[item.index], user_vector)
-            ratings.append((rating, item))
-        except:
-            print(item.index, " does not work FOR SOME FUCKING REASON")
-
-    # Sort by rating in descending order (highest first)
-    ratings.sort(key=lambda x: x[0], reverse=True)
-    
-    # Return just the items in sorted order
-    return [item for _, item in ratings]
\ No newline at end of file
+    rows = np.flatnonzero(allowed(slice(None)))
+    scores = np.asarray(item_vectors[rows] @ user_vector)
+    return RecommendedItems(np.asarray(candidates.ids[rows]), scores)
+
+
+def _score_active_items(user, item_vectors, user_vector):
+    # Models trained before the candidate arrays existed: items created after
+    # the last training run have no vector yet
+    candidates = np.array(
+        Item.objects.filter(status='active', index__isnull=False, index__lt=len(item_vectors))
+        .exclude(seller__userID=user.id)
+        .values_list('id', 'index'),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    scores = np.asarray(item_vectors[candidates[:, 1]] @ user_vector)
+    return RecommendedItems(candidates[:, 0], scores)
@@ -0,0 +1,336 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from bids.recommender import IVFIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'VECTORS_DIR': os.path.join(settings.BASE_DIR, 'data', 'latent_vectors'),
+    'CHECK_INTERVAL': 5,
+    'KEEP_VERSIONS': 3,
+    'TOP_N': 200,
+    'ANN_MIN_ITEMS': 100_000,
+    'ANN_LISTS': None,
+    'ANN_NPROBE': 16,
+    'ONLINE_UPDATES': True,
+    'ONLINE_UPDATE_INTERVAL': 1.0,
+    'SPARE_USER_ROWS': 10_000,
+}
+
+MANIFEST = 'manifest.json'
+
+# One trained model: user and item factor matrices, the user id of each user
+# row, the precomputed top-N item ids per user row, the item IVF index and
+# the candidate arrays, memory-mapped read-only
+Vectors = namedtuple('Vectors', ['version', 'users', 'user_ids', 'items', 'top_items', 'ann', 'candidates',
+                                 'manifest'])
+
+# Per item row (Item.index): the item id, whether the item is active and the
+# user id of its seller. Ids are sorted, so an id's row is found by bisection.
+Candidates = namedtuple('Candidates', ['ids', 'active', 'sellers'])
+
+
+def recommendations_config():
+    return {**DEFAULTS, **getattr(settings, 'RECOMMENDATIONS', {})}
+
+
+class VectorStore:
+    """
+    Latent vectors shared by every request of a process. Each trained model
+    is written to its own version directory, and a manifest naming the
+    current version is replaced atomically once both matrices are on disk.
+
+    Readers memory-map the matrices of the current version, so workers share
+    the OS page cache instead of reading the files per request. A version
+    maps user and item ids to its rows itself (user_row, item_row), so
+    Item.index and UserProfile.index, which a training run rewrites when it
+    starts, are never needed to read the version being served. current()
+    re-checks the manifest at most every CHECK_INTERVAL seconds. It swaps to a
+    new version by replacing a single reference, so requests that already hold
+    the previous Vectors keep using them, and it never waits for a reload
+    that another thread is doing.
+    """
+
+    def __init__(self):
+        self.config = recommendations_config()
+        self._vectors = None
+        self._manifest_stat = None
+        self._checked_at = 0.0
+        self._reload_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._writable_arrays = {}
+
+    @property
+    def directory(self):
+        return os.fspath(self.config['VECTORS_DIR'])
+
+    def current(self):
+        """Returns the current Vectors, or None when no model has been trained yet."""
+        if self._vectors is None or time.monotonic() - self._checked_at >= self.config['CHECK_INTERVAL']:
+            self.reload(wait=self._vectors is None)
+        return self._vectors
+
+    def reload(self, wait=True):
+        if not self._reload_lock.acquire(blocking=wait):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            manifest_path = os.path.join(self.directory, MANIFEST)
+            try:
+                stat = os.stat(manifest_path)
+                stat = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                stat = None
+            if self._vectors is not None and stat == self._manifest_stat:
+                return
+
+            if stat is None:
+                # Vectors saved before versioning sit directly in the directory
+                manifest, path = {'version': None}, self.directory
+            else:
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+                path = os.path.join(self.directory, 'versions', str(manifest['version']))
+            version = manifest['version']
+
+            try:
+                top_items = manifest.get('top_items')
+                vectors = Vectors(
+                    version,
+                    np.load(os.path.join(path, 'users.npy'), mmap_mode='r'),
+                    np.load(os.path.join(path, 'user_ids.npy'), mmap_mode='r') if manifest.get('user_ids') else None,
+                    np.load(os.path.join(path, 'items.npy'), mmap_mode='r'),
+                    np.load(os.path.join(path, top_items), mmap_mode='r') if top_items else None,
+                    IVFIndex(*(np.load(os.path.join(path, f'ivf_{name}.npy'), mmap_mode='r')
+                               for name in IVFIndex._fields)) if manifest.get('ann') else None,
+                    Candidates(*(np.load(os.path.join(path, f'item_{name}.npy'), mmap_mode='r')
+                                 for name in Candidates._fields)) if manifest.get('candidates') else None,
+                    manifest,
+                )
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not load latent vectors from {path}: {e}")
+                return
+
+            self._vectors = vectors
+            self._manifest_stat = stat
+            logger.info(f"Loaded latent vectors version {version}: "
+                        f"{vectors.users.shape[0]} users, {vectors.items.shape[0]} items")
+        finally:
+            self._reload_lock.release()
+
+    def publish(self, user_matrix, item_matrix, top_items=None, lists_updated_at=None, ann=None,
+                candidates=None, user_ids=None):
+        """
+        Writes a new version and makes it current. Older versions beyond
+        KEEP_VERSIONS are removed; processes that still map them keep their
+        pages until they move to the new version.
+
+        users.npy gets SPARE_USER_ROWS extra rows, starting at the mean user
+        vector, that allocate_user_row hands out to users who joined after
+        training. user_ids holds the sorted user id of each trained row; the
+        spare rows start without one.
+        """
+        versions_dir = os.path.join(self.directory, 'versions')
+        os.makedirs(versions_dir, exist_ok=True)
+        existing = sorted(int(name) for name in os.listdir(versions_dir) if name.isdigit())
+        version = existing[-1] + 1 if existing else 1
+
+        tmp_path = os.path.join(versions_dir, f'.{version}.tmp')
+        os.makedirs(tmp_path)
+        mean = user_matrix.mean(axis=0) if len(user_matrix) else np.full(user_matrix.shape[1], 0.5)
+        spare = np.tile(mean, (self.config['SPARE_USER_ROWS'], 1))
+        np.save(os.path.join(tmp_path, 'users.npy'), np.vstack([user_matrix, spare]))
+        np.save(os.path.join(tmp_path, 'next_user_row.npy'),
+                np.array([len(user_matrix)], dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'items.npy'), item_matrix)
+        if user_ids is not None:
+            np.save(os.path.join(tmp_path, 'user_ids.npy'), np.concatenate(
+                [np.asarray(user_ids, dtype=np.int64), np.full(self.config['SPARE_USER_ROWS'], -1, dtype=np.int64)]))
+        if top_items is not None:
+            np.save(os.path.join(tmp_path, 'top_items.npy'), top_items)
+        if ann is not None:
+            for name, array in ann._asdict().items():
+                np.save(os.path.join(tmp_path, f'ivf_{name}.npy'), array)
+        if candidates is not None:
+            for name, array in candidates._asdict().items():
+                np.save(os.path.join(tmp_path, f'item_{name}.npy'), array)
+        os.replace(tmp_path, os.path.join(versions_dir, str(version)))
+
+        now = time.time()
+        self._write_manifest({
+            'version': version, 'users': list(user_matrix.shape), 'items': list(item_matrix.shape),
+            'user_capacity': len(user_matrix) + self.config['SPARE_USER_ROWS'],
+            'created_at': now, 'top_items': 'top_items.npy' if top_items is not None else None,
+            'lists_updated_at': lists_updated_at or now, 'ann': ann is not None,
+            'candidates': candidates is not None, 'user_ids': user_ids is not None,
+        })
+
+        for old in existing[:max(len(existing) + 1 - self.config['KEEP_VERSIONS'], 0)]:
+            shutil.rmtree(os.path.join(versions_dir, str(old)), ignore_errors=True)
+        return version
+
+    def publish_lists(self, vectors, rows, lists, lists_updated_at):
+        """
+        Replaces the top-N lists of the given user rows in the current
+        version. The lists file is copied, patched and swapped in through the
+        manifest, so readers never see a partly written list. Returns False
+        when a newer version was published since vectors were loaded.
+        """
+        manifest_path = os.path.join(self.directory, MANIFEST)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['version'] != vectors.version or not manifest.get('top_items'):
+            return False
+
+        path = os.path.join(self.directory, 'versions', str(vectors.version))
+        previous = name = manifest['top_items']
+        if len(rows):
+            name = f'top_items.{int(lists_updated_at * 1000)}.npy'
+            shutil.copyfile(os.path.join(path, previous), os.path.join(path, name))
+            top_items = np.load(os.path.join(path, name), mmap_mode='r+')
+            top_items[rows] = lists
+            top_items.flush()
+            del top_items
+
+        self._write_manifest({**manifest, 'top_items': name, 'lists_updated_at': lists_updated_at})
+        if previous not in (name, 'top_items.npy'):
+            # Readers that mapped it keep their pages until they reload
+            os.remove(os.path.join(path, previous))
+        return True
+
+    def user_row(self, vectors, user_id):
+        """
+        The row of a user in a version's user matrix, or None when the user
+        has none yet: trained users are found by bisection, users given a
+        spare row since by a scan of the spare rows.
+        """
+        ids = vectors.user_ids
+        trained = vectors.manifest['users'][0]
+        row = int(np.searchsorted(ids[:trained], user_id))
+        if row < trained and ids[row] == user_id:
+            return row
+        spare = np.flatnonzero(ids[trained:] == user_id)
+        return trained + int(spare[0]) if len(spare) else None
+
+    def item_row(self, vectors, item_id):
+        """The row of an item in a version's item matrix, or None for items created after training."""
+        ids = vectors.candidates.ids
+        row = int(np.searchsorted(ids, item_id))
+        return row if row < len(ids) and ids[row] == item_id else None
+
+    def writable_users(self, vectors):
+        """
+        The user matrix of a version mapped for writing. The mapping is
+        shared, so rows written here are seen by every process that reads
+        the same version.
+        """
+        return self._writable(vectors, 'users.npy')
+
+    def set_items_active(self, item_ids, active):
+        """
+        Marks items active or inactive in the candidate arrays of the newest
+        version, through the same kind of shared mapping as writable_users.
+        Items that have no row, because they were created after training,
+        are skipped.
+        """
+        # A stat of the manifest, so the write does not land in a version that was just replaced
+        self.reload()
+        vectors = self._vectors
+        if vectors is None or vectors.candidates is None or not len(vectors.candidates.ids):
+            return
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        ids = vectors.candidates.ids
+        rows = np.minimum(np.searchsorted(ids, item_ids), len(ids) - 1)
+        rows = rows[ids[rows] == item_ids]
+        if len(rows):
+            with self._locked(vectors, 'item_active.lock'):
+                self._writable(vectors, 'item_active.npy')[rows] = active
+
+    def sync_items_active(self, version, active_ids):
+        """
+        Rewrites the active flags of a just published version from
+        active_ids(), the ids of the items active now. Status changes made
+        while the version was being written went to the version it replaced;
+        set_items_active waits for the read and the write here, so a change
+        committed meanwhile is not overwritten. Returns False when a newer
+        version was published since.
+        """
+        self.reload()
+        vectors = self._vectors
+        if vectors is None or vectors.version != version:
+            return False
+        if vectors.candidates is None or not len(vectors.candidates.ids):
+            return True
+        with self._locked(vectors, 'item_active.lock'):
+            active = np.isin(vectors.candidates.ids, np.asarray(active_ids(), dtype=np.int64))
+            flags = self._writable(vectors, 'item_active.npy')
+            changed = np.flatnonzero(flags != active)
+            flags[changed] = active[changed]
+        if len(changed):
+            logger.info(f"Synced the active flags of {len(changed)} items in version {version}")
+        return True
+
+    def _writable(self, vectors, name):
+        if vectors.version is None:
+            return None
+        key = (vectors.version, name)
+        if key not in self._writable_arrays:
+            path = os.path.join(self.directory, 'versions', str(vectors.version), name)
+            # Mappings of older versions are dropped
+            arrays = {k: v for k, v in self._writable_arrays.items() if k[0] == vectors.version}
+            arrays[key] = np.load(path, mmap_mode='r+')
+            self._writable_arrays = arrays
+        return self._writable_arrays[key]
+
+    def allocate_user_row(self, vectors, user_id):
+        """
+        Gives a user the next spare row of a version and records the user's
+        id for it. Returns the row, the one another process gave the user
+        first, or None when the spare rows are used up.
+        """
+        if vectors.version is None or vectors.user_ids is None:
+            return None
+        path = os.path.join(self.directory, 'versions', str(vectors.version))
+        with self._locked(vectors, 'allocate.lock'):
+            row = self.user_row(vectors, user_id)
+            if row is not None:
+                return row
+            next_row = np.load(os.path.join(path, 'next_user_row.npy'), mmap_mode='r+')
+            row = int(next_row[0])
+            if row >= len(vectors.users):
+                return None
+            self._writable(vectors, 'user_ids.npy')[row] = user_id
+            next_row[0] = row + 1
+            next_row.flush()
+            return row
+
+    @contextmanager
+    def _locked(self, vectors, name):
+        # Serializes writers of a version, in this process and the others on this host
+        path = os.path.join(self.directory, 'versions', str(vectors.version), name)
+        with self._file_lock, open(path, 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _write_manifest(self, manifest):
+        manifest_path = os.path.join(self.directory, MANIFEST)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+
+vector_store = VectorStore()
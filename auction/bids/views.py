@@ -1,5 +1,5 @@
 from bids.models import (Bid, Bidder, Location, Item, ItemImage, Seller, Category,
-                         SellerRating, BidderRating, WinningPair, Message, ItemImage, Visited)
+                         SellerRating, BidderRating, WinningPair, Message, ItemImage, Visited, ProxyBid)
 from django.contrib.auth.models import User
 from django.db.models import Q
 
@@ -8,7 +8,8 @@ from bids.serializers import (
     AdminItemSerializer, ItemCreateSerializer, ItemDetailSerializer, ItemListSerializer, OwnerItemDetailSerializer, OwnerItemUpdateSerializer,
     SellerRatingSerializer, BidderRatingSerializer, 
     SellerSerializer, CategorySerializer, UserSerializer, LocationSerializer,
-    WinningPairSerializer, MessageSerializer, CreateMessageSerializer, ItemImageSerializer
+    WinningPairSerializer, MessageSerializer, CreateMessageSerializer, ItemImageSerializer,
+    ProxyBidSerializer
     )
 
 from bids.permissions import (
@@ -17,6 +18,12 @@ from bids.permissions import (
     )
 
 from bids.utils import generate_recommendations
+from bids.bidding import place_bid, register_proxy_bid, BidRejected, ItemNotFound
+from bids.bidbook import bid_book
+from bids.metrics import metrics
+from bids.search import ItemSearchFilter
+from bids.pagination import KeysetPagination
+from bids.listing import ItemListRows
 from rest_framework.exceptions import ValidationError, PermissionDenied
 from django.utils import timezone
 from datetime import timedelta
@@ -31,11 +38,15 @@ import numpy as np
 class ItemViewSet(viewsets.ModelViewSet):
     queryset = Item.objects.all()
     authentication_classes = [JWTAuthentication]
-    filter_backends = [filters.OrderingFilter, filters.SearchFilter]
+    filter_backends = [filters.OrderingFilter, ItemSearchFilter]
     ordering_fields = ['ends', 'name', 'buy_price', 'current_bid']
     ordering = ['ends']
+    # LIKE search on databases without a full-text index
     search_fields = ['name', 'description']
+    pagination_class = KeysetPagination
     parser_classes = [MultiPartParser, FormParser, JSONParser]
+    # Most queries a request may run, whatever the page size; bids.tests fails above these
+    query_budgets = {'list': 3, 'ending_soon': 2, 'retrieve': 5}
 
     def check_edit_delete_validity(self, item:Item):
         if self.request.user.is_staff : return
@@ -89,8 +100,17 @@ class ItemViewSet(viewsets.ModelViewSet):
             return ItemDetailSerializer
         return ItemListSerializer
 
+    def get_object(self):
+        # get_serializer_class looks at the item too, so load it once per request
+        if not hasattr(self, '_object'):
+            self._object = super().get_object()
+        return self._object
+
     def get_queryset(self):
         queryset = Item.objects.all()
+        if self.action == 'retrieve':
+            # Many-valued relations depend on the serializer, which depends on the item
+            queryset = queryset.select_related(*ItemDetailSerializer.select_related_fields)
         if not self.request.user.is_staff:
             queryset = queryset.filter(status='active')
         filter_params = {
@@ -129,10 +149,16 @@ class ItemViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         user = request.user
         recommended = (request.query_params.get('ordering', '').lower() == 'recommended')
-        if recommended and not user.is_anonymous:
-            items = generate_recommendations(user)
-        else:
-            items = self.filter_queryset(self.get_queryset())
+        items = generate_recommendations(user) if recommended and not user.is_anonymous else None
+        if items is None:
+            # Users the recommender knows nothing about yet get the regular listing
+            items = ItemListRows.values(self.filter_queryset(self.get_queryset()))
+            rows = ItemListRows(request)
+            page = self.paginate_queryset(items)
+            if page is not None:
+                return self.get_paginated_response(rows.to_representation(page))
+            return Response(rows.to_representation(items))
+        items.queryset = ItemListSerializer.eager_loading(items.queryset)
         page = self.paginate_queryset(items)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -141,11 +167,12 @@ class ItemViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
     def retrieve(self, request, *args, **kwargs):
-        response = super().retrieve(request, *args, **kwargs)
-        if response.status_code == 200:
-            instance = self.get_object()
-            self.record_visit(request.user, instance)
-        return response
+        instance = self.get_object()
+        serializer = self.get_serializer(instance)
+        serializer.prefetch([instance])
+        data = serializer.data
+        self.record_visit(request.user, instance)
+        return Response(data)
 
     def update(self, request, pk=None, partial=False):
         try:
@@ -195,8 +222,8 @@ class ItemViewSet(viewsets.ModelViewSet):
             ends__lte=tomorrow,
             ends__gte=now,
         )
-        serializer = self.get_serializer(ending_soon, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        data = ItemListRows(request).to_representation(ItemListRows.values(ending_soon))
+        return Response(data, status=status.HTTP_200_OK)
     
     @action(detail=True, methods=['post'])
     def publish(self, pk, request):
@@ -223,6 +250,9 @@ class BidViewSet(viewsets.ModelViewSet):
     queryset = Bid.objects.all()
     permission_classes = [IsBidOwner]
     authentication_classes = [JWTAuthentication]
+    pagination_class = KeysetPagination
+    # Order followed by ?cursor= pages
+    ordering = ['-time']
 
     def get_serializer_class(self):
         if self.action in ['create', 'update']:
@@ -262,29 +292,10 @@ class BidViewSet(viewsets.ModelViewSet):
         return queryset
     
     def create(self, request):
-        serializer = self.get_serializer_class()
-        try:
-            item = self.request.data.get('item')
-        except:
-            return Response(
-                {'error': 'A valid item ID is required to place a bid.'}
-            )
-        try:
-            item = Item.objects.get(id=item)
-        except Item.DoesNotExist:
+        item_id = self.request.data.get('item')
+        if not item_id:
             return Response(
-                {'error': 'Item does not exist.'},
-                status=status.HTTP_404_NOT_FOUND,
-            )
-        if item.status != 'active':
-            return Response(
-                {'error': 'Cannot place a bid on an item that is not active.'},
-                status=status.HTTP_400_BAD_REQUEST,
-            )   
-        if item.ends < timezone.now():
-            item.check_and_update_status()
-            return Response(
-                {'error':'Auction has ended.'},           
+                {'error': 'A valid item ID is required to place a bid.'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
         try:
@@ -307,36 +318,70 @@ class BidViewSet(viewsets.ModelViewSet):
                 {'error': 'Invalid bid amount.'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        if bid_amount <= item.current_bid:
+        place = bid_book.place if bid_book.enabled else place_bid
+        try:
+            bid = place(item_id, bidder, bid_amount)
+        except ItemNotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except BidRejected as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer_class()
+        # The bid book accepts bids in memory and writes them behind
+        created = status.HTTP_201_CREATED if bid.pk is not None else status.HTTP_202_ACCEPTED
+        return Response(serializer(bid).data, status=created)
+    
+class ProxyBidViewSet(viewsets.ModelViewSet):
+    serializer_class = ProxyBidSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    http_method_names = ['get', 'post', 'delete']
+
+    def get_queryset(self):
+        queryset = ProxyBid.objects.filter(bidder__userID=self.request.user).order_by('-updated_at')
+        item_id = self.request.query_params.get('item', None)
+        if item_id:
+            queryset = queryset.filter(item__id=item_id)
+        return queryset
+
+    def create(self, request):
+        item_id = self.request.data.get('item')
+        if not item_id:
+            return Response(
+                {'error': 'A valid item ID is required to place a bid.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            bidder = Bidder.objects.get(userID=self.request.user)
+        except Bidder.DoesNotExist:
             return Response(
-                {'error': 'Bid amount must be greater than the current bid.'},
+                {'error': 'You must have a bidder profile to place a bid.'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        bid_data = {
-            'item': item.id,
-            'bidder': bidder.id,
-            'amount': bid_amount
-        }
-        print(bid_data)
-        bought = False
-        if item.buy_price and item.buy_price <= bid_amount:
-            bid_amount = item.buy_price
-            bought = True
-        print(serializer)
-        bid_serializer = serializer(data=bid_data)
-        if bid_serializer.is_valid():
-            bid_serializer.save()
-            item.current_bid = bid_amount
-            item.number_of_bids += 1
-            item.save()
-            if bought == True:
-                item.close()
-            return Response(bid_serializer.data, status=status.HTTP_201_CREATED)
-        return Response(
-            bid_serializer.errors,
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
+        try:
+            max_amount = float(self.request.data.get('max_amount'))
+        except (ValueError, TypeError):
+            return Response(
+                {'error': 'Invalid maximum bid amount.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if bid_book.enabled:
+            bid_book.hand_over(item_id)
+        try:
+            proxy = register_proxy_bid(item_id, bidder, max_amount)
+        except ItemNotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except BidRejected as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(proxy).data, status=status.HTTP_201_CREATED)
+
+class SchedulerMetricsViewSet(viewsets.ViewSet):
+    """Job metrics of the background scheduler and the current closing backlog."""
+    permission_classes = [permissions.IsAdminUser]
+    authentication_classes = [JWTAuthentication]
+
+    def list(self, request):
+        return Response(metrics.read())
+
 class BidderViewSet(viewsets.ModelViewSet):
     queryset = Bidder.objects.all()
     serializer_class = BidderSerializer
@@ -383,6 +428,8 @@ class SellerViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]
     permission_classes = [SellerPerms]
     authentication_classes = [JWTAuthentication]
+    pagination_class = KeysetPagination
+    query_budgets = {'my_items': 5}
 
     def get_queryset(self):
         queryset = self.queryset
@@ -421,6 +468,7 @@ class SellerViewSet(viewsets.ModelViewSet):
             queryset = seller.items.filter(status=status_param).order_by('ends')
         else:
             queryset = seller.items.all().order_by('ends')
+        queryset = self.get_serializer_class().eager_loading(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -712,6 +760,9 @@ class MessageViewset(viewsets.ModelViewSet):
     queryset = Message.objects.all()
     permission_classes = [permissions.IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    pagination_class = KeysetPagination
+    # Order followed by ?cursor= pages
+    ordering = ['-sent_at']
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -730,9 +781,9 @@ class MessageViewset(viewsets.ModelViewSet):
         read_param = self.request.query_params.get('read', None)
         if read_param:
             if read_param.lower() == 'true':
-                queryset = queryset.filter(read=True)
+                queryset = queryset.filter(is_read=True)
             elif read_param.lower() == 'false':
-                queryset = queryset.filter(read=False)
+                queryset = queryset.filter(is_read=False)
             else:
                 raise ValidationError('Invalid value for read parameter. Use "true" or "false".')
         if recipient_param: